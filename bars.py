@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+"""Intraday OHLCV bars of the DSE and CSE snapshots.
+
+The exchanges publish day figures, the volume and trades so far and the
+last, highest and lowest price of the day, every minute or so.  A
+`BarBuilder` is fed every snapshot as it comes and works out what traded in
+between from how those figures moved, into a bar per company and interval
+of so many minutes.  It only holds the last figures and the bar in the
+making of every company, and hands bars over as soon as their interval is
+over.
+
+Bars are written in the same CSV layout as the snapshots, company code,
+date and time first, so the charting tools that read those read these too.
+"""
+
+__author__ = "M Nasimul Haque (nasim.haque@gmail.com)"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2010 M Nasimul Haque"
+__license__ = "New-style BSD"
+
+import datetime
+
+import quotes
+
+
+BAR_HEADS = ['Company', 'Date', 'Time', 'Open', 'High', 'Low', 'Close',
+             'Trades', 'Volume']
+
+
+class Bar(object):
+    """What one company traded in one interval starting at `start`.
+
+    Prices are the ones the snapshots of the interval showed: `open` and
+    `close` the price of the first and the last one, `high` and `low` also
+    take in the day high and low when a snapshot moved them.
+    """
+
+    __slots__ = ('symbol', 'start', 'open', 'high', 'low', 'close', 'trades',
+                 'volume')
+
+    def __init__(self, symbol, start, open, high, low, close, trades=0,
+                 volume=0):
+        self.symbol = symbol
+        self.start = start
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.trades = trades
+        self.volume = volume
+
+    def __repr__(self):
+        return '<Bar %s at %s>' % (self.symbol, self.start)
+
+
+def _known(snapshot, field, i):
+    if field not in snapshot.columns:
+        return None
+    return quotes._value(field, snapshot.columns[field][i])
+
+
+class BarBuilder(object):
+    """Makes bars of `minutes` out of the snapshots of one exchange.
+
+    Intervals start at midnight and every `minutes` after it.  Volume and
+    trades start again from nothing every day; on the day the builder is
+    started, what traded before its first snapshot is left out rather than
+    put into the first interval.
+    """
+
+    def __init__(self, minutes):
+        self.minutes = minutes
+        self._start = None
+        self._day = None
+        self._from_open = False
+        # The figures of the last snapshot, by company: (volume, trades,
+        # high, low).
+        self._last = {}
+        self._bars = {}
+
+    def interval(self, when):
+        """Returns the start of the interval `when` is in."""
+        minutes = when.hour * 60 + when.minute
+        return (datetime.datetime.combine(when.date(), datetime.time()) +
+                datetime.timedelta(minutes=minutes - minutes % self.minutes))
+
+    def add(self, snapshot):
+        """Takes in `snapshot`, which must be newer than the ones before.
+        Returns the bars an interval of which is over, by company."""
+        start = self.interval(snapshot.last_update)
+        finished = []
+        if self._start is not None and start != self._start:
+            finished = self.flush()
+        self._start = start
+
+        day = snapshot.last_update.date()
+        if day != self._day:
+            self._from_open = self._day is not None
+            self._day = day
+            self._last = {}
+
+        price_field = snapshot.layout.price
+        for i, symbol in enumerate(snapshot.symbols):
+            price = _known(snapshot, price_field, i)
+            volume = _known(snapshot, 'volume', i)
+            if price is None or volume is None:
+                continue
+            trades = _known(snapshot, 'trades', i)
+            high = _known(snapshot, 'high', i)
+            low = _known(snapshot, 'low', i)
+
+            last = self._last.get(symbol)
+            self._last[symbol] = (volume, trades, high, low)
+            if last is None:
+                if not self._from_open:
+                    continue
+                last = (0, 0, None, None)
+            last_volume, last_trades, last_high, last_low = last
+            if volume <= last_volume:
+                # Nothing traded, or the exchange corrected its figures and
+                # they count from here on.
+                continue
+
+            bar_high = bar_low = price
+            if high and (last_high is None or high > last_high):
+                bar_high = max(price, high)
+            if low and (not last_low or low < last_low):
+                bar_low = min(price, low)
+            traded = 0
+            if trades is not None and last_trades is not None:
+                traded = max(trades - last_trades, 0)
+
+            bar = self._bars.get(symbol)
+            if bar is None:
+                self._bars[symbol] = Bar(symbol, start, price, bar_high,
+                                         bar_low, price, traded,
+                                         volume - last_volume)
+                continue
+            bar.high = max(bar.high, bar_high)
+            bar.low = min(bar.low, bar_low)
+            bar.close = price
+            bar.trades += traded
+            bar.volume += volume - last_volume
+        return finished
+
+    def flush(self):
+        """Returns the bars of the interval in progress, by company, as
+        they are so far, and starts the next interval afresh."""
+        finished = [self._bars[symbol] for symbol in sorted(self._bars)]
+        self._bars = {}
+        self._start = None
+        return finished
+
+
+def to_rows(bars, layout, date_format):
+    """Returns `[symbol, date, time, open, high, low, close, trades,
+    volume]` text rows of `bars`, prices printed the way `layout` prints
+    its price."""
+    price = layout.price
+    return [[bar.symbol, bar.start.strftime(date_format),
+             bar.start.strftime("%H:%M:%S"), layout.format(price, bar.open),
+             layout.format(price, bar.high), layout.format(price, bar.low),
+             layout.format(price, bar.close), str(bar.trades),
+             str(bar.volume)]
+            for bar in bars]
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+"""Times the ways dsnap.py can find out when the DSE prices were updated.
+
+The recorded pages in bench/fixtures are served from a local web server
+that waits `--latency` before answering and sends no faster than `--rate`,
+so round trips cost what they would against dsebd.org.  dsnap's DSE
+handler is run against it with every time strategy and the wall time and
+the bytes of the index page it read are reported.
+
+    python bench/fetchbench.py --latency 300 --rate 64
+"""
+
+__author__ = "M Nasimul Haque (nasim.haque@gmail.com)"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2010 M Nasimul Haque"
+__license__ = "New-style BSD"
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import BaseHTTPServer
+import SocketServer
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import dsnap
+import stockparser
+
+import parsebench
+
+
+PAGES = {
+    '/': parsebench.DSE_INDEX_FIXTURE,
+    '/latest_share_price_all.php': parsebench.DSE_LATEST_FIXTURE,
+}
+
+STRATEGIES = [stockparser.TIME_INDEX, stockparser.TIME_PARTIAL,
+              stockparser.TIME_CONCURRENT]
+
+
+class SlowServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Serves the fixtures like a far away server would."""
+
+    daemon_threads = True
+
+    def __init__(self, latency, rate):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           SlowRequestHandler)
+        self.latency = latency
+        self.rate = rate
+        self.pages = dict((path, parsebench.load_fixture(name))
+                          for path, name in PAGES.items())
+        self.sent = {}
+        self.lock = threading.Lock()
+
+    def count(self, path, nbytes):
+        self.lock.acquire()
+        try:
+            self.sent[path] = self.sent.get(path, 0) + nbytes
+        finally:
+            self.lock.release()
+
+    def handle_error(self, request, client_address):
+        # A client that had what it wanted hangs up mid page, that is fine.
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request,
+                                                   client_address)
+
+
+class SlowRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    chunk_size = 1024
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency)
+        body = server.pages.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        for i in xrange(0, len(body), self.chunk_size):
+            chunk = body[i:i + self.chunk_size]
+            self.wfile.write(chunk)
+            self.wfile.flush()
+            server.count(self.path, len(chunk))
+            if server.rate:
+                time.sleep(float(len(chunk)) / server.rate)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_strategy(server, strategy):
+    base = 'http://127.0.0.1:%d/' % server.server_address[1]
+    saved = (dsnap.DSE_ROOT_URL, dsnap.DSE_LATEST_URL, dsnap.CSV_OUTPUT_DIR,
+             dsnap.verbose_mode, dsnap.time_strategy, dsnap._state)
+    dsnap.DSE_ROOT_URL = base
+    dsnap.DSE_LATEST_URL = base + 'latest_share_price_all.php'
+    dsnap.CSV_OUTPUT_DIR = tempfile.mkdtemp()
+    dsnap.verbose_mode = False
+    dsnap.time_strategy = strategy
+    dsnap._state = None
+    server.sent.clear()
+    try:
+        start = time.time()
+        dsnap.DSEHandler().process()
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(dsnap.CSV_OUTPUT_DIR)
+        (dsnap.DSE_ROOT_URL, dsnap.DSE_LATEST_URL, dsnap.CSV_OUTPUT_DIR,
+         dsnap.verbose_mode, dsnap.time_strategy, dsnap._state) = saved
+    return elapsed, server.sent.get('/', 0)
+
+
+def run(latency, rate, repeat, strategies):
+    server = SlowServer(latency, rate)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+
+    results = []
+    try:
+        for strategy in strategies:
+            times = []
+            for i in xrange(repeat):
+                elapsed, index_bytes = run_strategy(server, strategy)
+                times.append(elapsed)
+            results.append({'strategy': strategy,
+                            'best_ms': min(times) * 1000,
+                            'mean_ms': sum(times) / len(times) * 1000,
+                            'index_bytes': index_bytes})
+    finally:
+        server.shutdown()
+    return results
+
+
+def print_results(results):
+    first = results and results[0]['best_ms']
+    print('%-12s %10s %10s %12s %8s' % ('strategy', 'best ms', 'mean ms',
+                                        'index bytes', 'speedup'))
+    for r in results:
+        print('%-12s %10.1f %10.1f %12d %7.2fx' % (
+            r['strategy'], r['best_ms'], r['mean_ms'], r['index_bytes'],
+            r['best_ms'] and first / r['best_ms'] or 0))
+
+
+def parse_options():
+    parser = OptionParser("Usage: %prog [options] [strategy ...]")
+    parser.set_defaults(latency=300, rate=64, repeat=3)
+    parser.add_option("-l", "--latency", type="float", dest="latency",
+                      metavar="MS",
+                      help="wait MS before answering a request (default: 300)")
+    parser.add_option("-b", "--rate", type="float", dest="rate",
+                      metavar="KB",
+                      help="send at most KB kilobytes a second, 0 for no "
+                           "limit (default: 64)")
+    parser.add_option("-r", "--repeat", type="int", dest="repeat",
+                      metavar="N",
+                      help="run every strategy N times (default: 3)")
+    parser.add_option("-j", "--json", dest="json_file", metavar="FILE",
+                      help="write the results to FILE as JSON")
+    return parser.parse_args()
+
+
+def main():
+    options, strategies = parse_options()
+    results = run(options.latency / 1000.0, options.rate * 1024,
+                  options.repeat, strategies or STRATEGIES)
+    print_results(results)
+
+    if options.json_file:
+        f = open(options.json_file, 'w')
+        try:
+            json.dump({'latency_ms': options.latency,
+                       'rate_kb': options.rate,
+                       'results': results}, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+
+
+if __name__ == '__main__':
+    main()
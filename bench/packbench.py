@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""Measures how snapshots pack for memcache at every zlib level.
+
+CSV snapshots of made up DSE pages with N companies are packed and unpacked
+with snappack the way main.py does it, and the compression ratio, the
+number of memcache chunks and the time packing and unpacking take are
+reported.
+
+    python bench/packbench.py -n 300,3000,30000 --levels 1,6,9
+"""
+
+__author__ = "M Nasimul Haque (nasim.haque@gmail.com)"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2010 M Nasimul Haque"
+__license__ = "New-style BSD"
+
+import os
+import sys
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import quotes
+import snappack
+import stockparser
+
+import scalebench
+import synthgen
+
+
+def snapshot(n):
+    """Returns the CSV main.py would save for a DSE page with `n`
+    companies."""
+    heads, rows = stockparser.parse_dse(synthgen.dse_price_page(n))
+    snapshot = quotes.DSE.snapshot(rows, synthgen.DEFAULT_LAST_UPDATE)
+    rows = quotes.to_rows(snapshot, "%m-%d-%Y")[0]
+    return stockparser.to_csv(rows, stockparser.stamp_heads(heads))
+
+
+def run(sizes, levels, repeat):
+    results = []
+    for n in sizes:
+        data = snapshot(n)
+        for level in levels:
+            stats = snappack.PackStats()
+            manifest, chunks = snappack.pack(data, level=level, stats=stats)
+            pack_time = scalebench.best_time(
+                lambda: snappack.pack(data, level=level), repeat)
+            unpack_time = scalebench.best_time(
+                lambda: snappack.unpack(manifest, chunks), repeat)
+            results.append({'n': n, 'level': level, 'bytes': stats.size,
+                            'packed_bytes': stats.packed_size,
+                            'ratio': stats.ratio(), 'chunks': stats.chunks,
+                            'pack_ms': pack_time * 1000,
+                            'unpack_ms': unpack_time * 1000})
+    return results
+
+
+def print_results(results):
+    print('%7s %5s %10s %10s %7s %6s %9s %9s' % (
+        'n', 'level', 'bytes', 'packed', 'ratio', 'chunks', 'pack ms',
+        'unpack ms'))
+    for r in results:
+        print('%7d %5d %10d %10d %6.1f%% %6d %9.2f %9.2f' % (
+            r['n'], r['level'], r['bytes'], r['packed_bytes'],
+            r['ratio'] * 100, r['chunks'], r['pack_ms'], r['unpack_ms']))
+
+
+def parse_options():
+    parser = OptionParser("Usage: %prog [options]")
+    parser.set_defaults(sizes='300,3000,30000', levels='1,6,9', repeat=3)
+    parser.add_option("-n", "--sizes", dest="sizes", metavar="N,N,...",
+                      help="numbers of companies to try "
+                           "(default: 300,3000,30000)")
+    parser.add_option("-l", "--levels", dest="levels", metavar="L,L,...",
+                      help="zlib levels to try (default: 1,6,9)")
+    parser.add_option("-r", "--repeat", type="int", dest="repeat",
+                      metavar="N",
+                      help="time everything N times (default: 3)")
+    parser.add_option("-j", "--json", dest="json_file", metavar="FILE",
+                      help="write the results to FILE as JSON")
+    return parser.parse_args()[0]
+
+
+def main():
+    options = parse_options()
+    results = run([int(n) for n in options.sizes.split(',')],
+                  [int(level) for level in options.levels.split(',')],
+                  options.repeat)
+    print_results(results)
+
+    if options.json_file:
+        f = open(options.json_file, 'w')
+        try:
+            json.dump(results, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+
+
+if __name__ == '__main__':
+    main()
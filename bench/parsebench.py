@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+
+"""Benchmarks the DSE and CSE page parsers against recorded pages.
+
+Every parse strategy stockparser offers is timed on the fixtures in
+bench/fixtures.  For each one the best and mean time, rows per second, the
+peak memory it took and the number of objects it left allocated are
+reported, and the rows are checked against the ones the full BeautifulSoup
+parse gives.
+
+    python bench/parsebench.py --json results.json
+    python bench/parsebench.py --baseline results.json
+
+With --baseline the run fails when a strategy got slower than the
+tolerance allows or stopped returning the same rows.
+"""
+
+__author__ = "M Nasimul Haque (nasim.haque@gmail.com)"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2010 M Nasimul Haque"
+__license__ = "New-style BSD"
+
+import cStringIO as StringIO
+import gc
+import os
+import subprocess
+import sys
+import time
+from optparse import OptionParser, SUPPRESS_HELP
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+FIXTURE_DIR = os.path.join(BENCH_DIR, 'fixtures')
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import stockparser
+
+
+DSE_LATEST_FIXTURE = 'dse_latest_share_price_all.html'
+DSE_INDEX_FIXTURE = 'dse_index.html'
+CSE_LATEST_FIXTURE = 'cse_top.htm'
+
+
+# Every strategy returns the rows it found and whatever it has to keep
+# alive while they are used, the parse tree for the BeautifulSoup ones.
+
+def dse_full(markup):
+    heads, rows, soup = stockparser.parse_dse_tree(markup, strained=False)
+    return rows, soup
+
+def dse_strained(markup):
+    heads, rows, soup = stockparser.parse_dse_tree(markup, strained=True)
+    return rows, soup
+
+def dse_stream(markup):
+    heads, rows = stockparser.parse_dse_stream(markup)
+    return rows, None
+
+def cse_full(markup):
+    pres, soup = stockparser.parse_cse_tree(markup, strained=False)
+    return stockparser.parse_cse_rows(pres[1])[0], soup
+
+def cse_strained(markup):
+    pres, soup = stockparser.parse_cse_tree(markup, strained=True)
+    return stockparser.parse_cse_rows(pres[1])[0], soup
+
+def cse_regex(markup):
+    pres = stockparser.parse_cse(markup, stockparser.PARSE_REGEX)
+    return stockparser.parse_cse_rows(pres[1])[0], None
+
+def dse_index_time(markup):
+    return [[stockparser.parse_dse_time(markup)]], None
+
+def dse_index_time_partial(markup):
+    return [[stockparser.read_dse_time(StringIO.StringIO(markup))[0]]], None
+
+
+# (name, fixture, strategy, name of the strategy whose rows must match)
+STRATEGIES = [
+    ('dse-full', DSE_LATEST_FIXTURE, dse_full, 'dse-full'),
+    ('dse-strained', DSE_LATEST_FIXTURE, dse_strained, 'dse-full'),
+    ('dse-stream', DSE_LATEST_FIXTURE, dse_stream, 'dse-full'),
+    ('dse-index-time', DSE_INDEX_FIXTURE, dse_index_time, 'dse-index-time'),
+    ('dse-index-read', DSE_INDEX_FIXTURE, dse_index_time_partial,
+     'dse-index-time'),
+    ('cse-full', CSE_LATEST_FIXTURE, cse_full, 'cse-full'),
+    ('cse-strained', CSE_LATEST_FIXTURE, cse_strained, 'cse-full'),
+    ('cse-regex', CSE_LATEST_FIXTURE, cse_regex, 'cse-full'),
+]
+
+
+def load_fixture(name):
+    f = open(os.path.join(FIXTURE_DIR, name), 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def _max_rss():
+    # ru_maxrss survives exec() on Linux, so a child would report the
+    # parent's peak.  VmHWM is per address space and does not.
+    try:
+        f = open('/proc/self/status')
+        try:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+        finally:
+            f.close()
+    except IOError:
+        pass
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _memory_profile(func, markup):
+    gc.collect()
+    objects = len(gc.get_objects())
+    rss = _max_rss()
+    rows, keep = func(markup)
+    return {'peak_rss_kb': _max_rss() - rss,
+            'objects': len(gc.get_objects()) - objects}
+
+
+def memory_profile(name):
+    """Profiles strategy `name` in a fresh interpreter, so that every
+    strategy starts from the same memory high-water mark."""
+    proc = subprocess.Popen([sys.executable, os.path.realpath(__file__),
+                             '--memory-profile', name],
+                            stdout=subprocess.PIPE)
+    out = proc.communicate()[0]
+    return json.loads(out)
+
+
+def get_strategy(name):
+    for strategy in STRATEGIES:
+        if strategy[0] == name:
+            return strategy
+    raise KeyError(name)
+
+
+def run_strategy(name, repeat):
+    name, fixture, func = get_strategy(name)[:3]
+    markup = load_fixture(fixture)
+    times = []
+    for i in xrange(repeat):
+        gc.collect()
+        start = time.time()
+        rows, keep = func(markup)
+        times.append(time.time() - start)
+        del keep
+
+    best = min(times)
+    result = {'rows': len(rows),
+              'best_ms': best * 1000,
+              'mean_ms': sum(times) / len(times) * 1000,
+              'rows_per_sec': best and len(rows) / best or 0.0}
+    result.update(memory_profile(name))
+    return result, rows
+
+
+def _plain_rows(rows):
+    return [map(unicode, row) for row in rows]
+
+
+def run(repeat, only=None):
+    results = []
+    reference_rows = {}
+    for name, fixture, func, reference in STRATEGIES:
+        if only and name not in only:
+            continue
+        result, rows = run_strategy(name, repeat)
+        rows = _plain_rows(rows)
+        if reference not in reference_rows:
+            if reference == name:
+                reference_rows[reference] = rows
+            else:
+                ref_fixture, ref_func = get_strategy(reference)[1:3]
+                ref_rows = ref_func(load_fixture(ref_fixture))[0]
+                reference_rows[reference] = _plain_rows(ref_rows)
+        result['strategy'] = name
+        result['fixture'] = fixture
+        result['matches_reference'] = reference_rows[reference] == rows
+        results.append(result)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of regressions of `results` against `baseline`."""
+    previous = dict((r['strategy'], r) for r in baseline['results'])
+    regressions = []
+    for result in results:
+        name = result['strategy']
+        if not result['matches_reference']:
+            regressions.append('%s: rows differ from the reference parse'
+                               % name)
+        old = previous.get(name)
+        if old is None or not old['rows_per_sec']:
+            continue
+        ratio = result['rows_per_sec'] / old['rows_per_sec']
+        if ratio < 1 - tolerance:
+            regressions.append('%s: %.0f rows/sec, was %.0f (%.0f%% slower)'
+                               % (name, result['rows_per_sec'],
+                                  old['rows_per_sec'], (1 - ratio) * 100))
+    return regressions
+
+
+def print_results(results):
+    print('%-16s %6s %10s %10s %12s %10s %9s %5s' % (
+        'strategy', 'rows', 'best ms', 'mean ms', 'rows/sec', 'peak KB',
+        'objects', 'same'))
+    for r in results:
+        print('%-16s %6d %10.2f %10.2f %12.0f %10d %9d %5s' % (
+            r['strategy'], r['rows'], r['best_ms'], r['mean_ms'],
+            r['rows_per_sec'], r['peak_rss_kb'], r['objects'],
+            r['matches_reference'] and 'yes' or 'NO'))
+
+
+def parse_options():
+    parser = OptionParser("Usage: %prog [options] [strategy ...]")
+    parser.set_defaults(repeat=10, tolerance=0.25)
+    parser.add_option("-r", "--repeat", type="int", dest="repeat",
+                      help="time every strategy N times (default: 10)",
+                      metavar="N")
+    parser.add_option("-j", "--json", dest="json_file", metavar="FILE",
+                      help="write the results to FILE as JSON")
+    parser.add_option("-b", "--baseline", dest="baseline_file",
+                      metavar="FILE",
+                      help="fail on regressions against the JSON results "
+                           "in FILE")
+    parser.add_option("--memory-profile", dest="memory_profile",
+                      metavar="STRATEGY", help=SUPPRESS_HELP)
+    parser.add_option("-t", "--tolerance", type="float", dest="tolerance",
+                      help="allowed rows/sec drop against the baseline "
+                           "(default: 0.25)")
+    return parser.parse_args()
+
+
+def main():
+    options, only = parse_options()
+    if options.memory_profile:
+        name, fixture, func = get_strategy(options.memory_profile)[:3]
+        sys.stdout.write(json.dumps(_memory_profile(func,
+                                                    load_fixture(fixture))))
+        return
+
+    results = run(options.repeat, only)
+    print_results(results)
+
+    if options.json_file:
+        f = open(options.json_file, 'w')
+        try:
+            json.dump({'python': sys.version.split()[0],
+                       'repeat': options.repeat,
+                       'results': results}, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+
+    if options.baseline_file:
+        f = open(options.baseline_file)
+        try:
+            baseline = json.load(f)
+        finally:
+            f.close()
+        regressions = compare(results, baseline, options.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+    elif [r for r in results if not r['matches_reference']]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+"""Charts how parsing and CSV writing scale with the number of companies.
+
+Pages with N companies are made up by synthgen and run through the
+stockparser strategies, the CSV writing main.py does and dsnap.py's
+handlers end to end, fully offline.  Time per row should stay flat as N
+grows if the row loops are linear.
+
+    python bench/scalebench.py -n 100,1000,10000 --csv scale.csv
+"""
+
+__author__ = "M Nasimul Haque (nasim.haque@gmail.com)"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2010 M Nasimul Haque"
+__license__ = "New-style BSD"
+
+import csv
+import gc
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser, SUPPRESS_HELP
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import dsnap
+import quotes
+import stockparser
+
+import parsebench
+import synthgen
+
+
+def _dse_rows(markup, mode):
+    return stockparser.parse_dse(markup, mode)[1]
+
+def _cse_rows(markup, mode):
+    pres = stockparser.parse_cse(markup, mode)
+    return stockparser.parse_cse_rows(pres[1])[0]
+
+def _to_csv(rows, layout):
+    # What main.py does with the parsed rows.
+    snapshot = layout.snapshot(rows, synthgen.DEFAULT_LAST_UPDATE)
+    return stockparser.to_csv(quotes.to_rows(snapshot, "%m-%d-%Y")[0])
+
+
+EXCHANGES = {
+    'dse': (synthgen.dse_price_page, _dse_rows, stockparser.DSE_PARSE_MODES,
+            quotes.DSE),
+    'cse': (synthgen.cse_page, _cse_rows, stockparser.CSE_PARSE_MODES,
+            quotes.CSE),
+}
+
+
+class OfflinePages(object):
+    """Serves made up pages to dsnap's handlers instead of the exchanges."""
+
+    def __init__(self, n):
+        self.pages = {
+            dsnap.DSE_ROOT_URL: synthgen.dse_index_page(),
+            dsnap.DSE_LATEST_URL: synthgen.dse_price_page(n),
+            dsnap.CSE_LATEST_URL: synthgen.cse_page(n),
+        }
+
+    def install(self):
+        pages = self.pages
+        self._download_html = dsnap.AbstractStockExchangeHandler.download_html
+        self._output_dir = dsnap.CSV_OUTPUT_DIR
+        self._verbose = dsnap.verbose_mode
+        self._state = dsnap._state
+        dsnap.AbstractStockExchangeHandler.download_html = \
+            lambda handler, url, conditional=False: pages[url]
+        dsnap.CSV_OUTPUT_DIR = tempfile.mkdtemp()
+        dsnap.verbose_mode = False
+
+    def restore(self):
+        shutil.rmtree(dsnap.CSV_OUTPUT_DIR)
+        dsnap.AbstractStockExchangeHandler.download_html = self._download_html
+        dsnap.CSV_OUTPUT_DIR = self._output_dir
+        dsnap.verbose_mode = self._verbose
+        dsnap._state = self._state
+
+    def forget(self):
+        """Lets the next capture start from scratch, instead of finding the
+        page unchanged and its snapshot already in the history."""
+        dsnap._state = None
+        shutil.rmtree(dsnap.CSV_OUTPUT_DIR)
+        os.mkdir(dsnap.CSV_OUTPUT_DIR)
+
+
+def best_time(func, repeat, setup=None):
+    """Returns the best time of `repeat` calls of `func`, each after a
+    call of `setup` that is not timed."""
+    times = []
+    for i in xrange(repeat):
+        if setup is not None:
+            setup()
+        gc.collect()
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def _memory_profile(exchange, mode, n):
+    generate, rows_of, modes, layout = EXCHANGES[exchange]
+    markup = generate(n)
+    gc.collect()
+    rss = parsebench._max_rss()
+    _to_csv(rows_of(markup, mode), layout)
+    return {'peak_rss_kb': parsebench._max_rss() - rss}
+
+
+def memory_profile(exchange, mode, n):
+    proc = subprocess.Popen([sys.executable, os.path.realpath(__file__),
+                             '--memory-profile',
+                             '%s:%s:%d' % (exchange, mode, n)],
+                            stdout=subprocess.PIPE)
+    return json.loads(proc.communicate()[0])
+
+
+def run(sizes, exchanges, modes, repeat):
+    results = []
+    for n in sizes:
+        for exchange in exchanges:
+            generate, rows_of, exchange_modes, layout = EXCHANGES[exchange]
+            markup = generate(n)
+            rows = rows_of(markup, exchange_modes[0])
+
+            steps = [('csv', lambda: _to_csv(rows, layout))]
+            for mode in exchange_modes:
+                if not modes or mode in modes:
+                    steps.append((mode,
+                                  lambda mode=mode: rows_of(markup, mode)))
+
+            for step, func in steps:
+                elapsed = best_time(func, repeat)
+                result = {'n': n, 'exchange': exchange, 'step': step,
+                          'rows': len(rows), 'ms': elapsed * 1000,
+                          'us_per_row': elapsed * 1e6 / max(len(rows), 1),
+                          'peak_rss_kb': None}
+                if step != 'csv':
+                    result.update(memory_profile(exchange, step, n))
+                results.append(result)
+
+        pages = OfflinePages(n)
+        pages.install()
+        try:
+            for exchange, handler in (('dse', dsnap.DSEHandler),
+                                      ('cse', dsnap.CSEHandler)):
+                if exchange not in exchanges:
+                    continue
+                elapsed = best_time(lambda: handler().process(), repeat,
+                                    pages.forget)
+                results.append({'n': n, 'exchange': exchange,
+                                'step': 'dsnap', 'rows': n,
+                                'ms': elapsed * 1000,
+                                'us_per_row': elapsed * 1e6 / n,
+                                'peak_rss_kb': None})
+        finally:
+            pages.restore()
+    return results
+
+
+def print_results(results):
+    first = {}
+    print('%-4s %-9s %7s %7s %11s %10s %8s %10s' % (
+        'exch', 'step', 'n', 'rows', 'ms', 'us/row', 'scaling', 'peak KB'))
+    for r in results:
+        key = (r['exchange'], r['step'])
+        first.setdefault(key, r['us_per_row'])
+        scaling = first[key] and r['us_per_row'] / first[key] or 0
+        peak = r['peak_rss_kb'] is not None and str(r['peak_rss_kb']) or '-'
+        print('%-4s %-9s %7d %7d %11.2f %10.2f %7.2fx %10s' % (
+            r['exchange'], r['step'], r['n'], r['rows'], r['ms'],
+            r['us_per_row'], scaling, peak))
+
+
+def write_csv(results, filename):
+    fields = ['exchange', 'step', 'n', 'rows', 'ms', 'us_per_row',
+              'peak_rss_kb']
+    f = open(filename, 'wb')
+    try:
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        for r in results:
+            writer.writerow([r[field] for field in fields])
+    finally:
+        f.close()
+
+
+def parse_options():
+    parser = OptionParser("Usage: %prog [options]")
+    parser.set_defaults(sizes='100,1000,10000', exchanges='dse,cse',
+                        repeat=3)
+    parser.add_option("-n", "--sizes", dest="sizes", metavar="N,N,...",
+                      help="numbers of companies to try "
+                           "(default: 100,1000,10000)")
+    parser.add_option("-e", "--exchanges", dest="exchanges",
+                      metavar="EXCHANGES",
+                      help="exchanges to try (default: dse,cse)")
+    parser.add_option("-m", "--modes", dest="modes", metavar="MODES",
+                      help="parse modes to try (default: all of them)")
+    parser.add_option("-r", "--repeat", type="int", dest="repeat",
+                      metavar="N",
+                      help="time every step N times (default: 3)")
+    parser.add_option("-c", "--csv", dest="csv_file", metavar="FILE",
+                      help="write the results to FILE as CSV for charting")
+    parser.add_option("-j", "--json", dest="json_file", metavar="FILE",
+                      help="write the results to FILE as JSON")
+    parser.add_option("--memory-profile", dest="memory_profile",
+                      help=SUPPRESS_HELP)
+    return parser.parse_args()[0]
+
+
+def main():
+    options = parse_options()
+    if options.memory_profile:
+        exchange, mode, n = options.memory_profile.split(':')
+        sys.stdout.write(json.dumps(_memory_profile(exchange, mode, int(n))))
+        return
+
+    modes = options.modes and options.modes.split(',') or None
+    results = run([int(n) for n in options.sizes.split(',')],
+                  options.exchanges.split(','), modes, options.repeat)
+    print_results(results)
+
+    if options.csv_file:
+        write_csv(results, options.csv_file)
+    if options.json_file:
+        f = open(options.json_file, 'w')
+        try:
+            json.dump(results, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+
+
+if __name__ == '__main__':
+    main()
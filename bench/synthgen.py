@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+"""Generates DSE and CSE style pages with any number of companies.
+
+The pages follow the layout of the recorded fixtures and carry the quirks
+the parsers have to live with: a <body> tag sgmllib chokes on, `&nbsp;`
+padded headers, tag-like text in scripts, `<br/>`, upper case tags,
+values with and without <font> around them, companies that did not trade
+and one digit days and hours in the CSE date.  Output is deterministic for
+a given seed and needs no network.
+
+    python bench/synthgen.py --dse 10000 -o dse.html
+    python bench/synthgen.py --cse 10000 -o cse.htm
+"""
+
+__author__ = "M Nasimul Haque (nasim.haque@gmail.com)"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2010 M Nasimul Haque"
+__license__ = "New-style BSD"
+
+import datetime
+import random
+import sys
+from optparse import OptionParser
+
+
+DEFAULT_LAST_UPDATE = datetime.datetime(2010, 10, 3, 9, 5, 0)
+
+DSE_HEADS = ['Trading Code', 'LTP*', 'High', 'Low', 'Close Price', 'YCP',
+             'Change', 'Trade', 'Value (mn)', 'Volume']
+
+_LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_SUFFIXES = ['BANK', 'PHARMA', 'TEX', 'CEM', 'MF', 'INS', 'POWER', 'FOODS',
+             'STEEL', 'LEASING', '']
+
+
+def symbols(n, seed=0):
+    """Returns `n` unique trading codes."""
+    rnd = random.Random(seed)
+    seen = set()
+    codes = []
+    while len(codes) < n:
+        code = ''.join([rnd.choice(_LETTERS)
+                        for i in range(rnd.randint(2, 6))])
+        code += rnd.choice(_SUFFIXES)
+        if code in seen:
+            continue
+        seen.add(code)
+        codes.append(code)
+    return codes
+
+
+def quotes(n, seed=0, inactive=0.15):
+    """Returns `n` `(code, ltp, high, low, close, ycp, change, trades, value,
+    volume)` tuples, an `inactive` share of them without any trade."""
+    rnd = random.Random(seed)
+    rows = []
+    for code in symbols(n, seed):
+        ycp = round(rnd.uniform(5, 2500), 1)
+        if rnd.random() < inactive:
+            rows.append((code, ycp, ycp, ycp, ycp, ycp, 0.0, 0, 0.0, 0))
+            continue
+        ltp = round(ycp * rnd.uniform(0.9, 1.1), 1)
+        high = round(max(ltp, ycp) * rnd.uniform(1, 1.03), 1)
+        low = round(min(ltp, ycp) * rnd.uniform(0.97, 1), 1)
+        trades = rnd.randint(1, 5000)
+        volume = rnd.randint(trades, trades * 500)
+        rows.append((code, ltp, high, low, ltp, ycp, round(ltp - ycp, 1),
+                     trades, round(volume * ltp / 1e6, 3), volume))
+    return rows
+
+
+def dse_index_page(last_update=DEFAULT_LAST_UPDATE):
+    stamp = last_update.strftime('%b %d, %Y at %H:%M:%S')
+    return ('<html><head><title>Dhaka Stock Exchange Ltd.</title></head>\r\n'
+            '<body bgcolor="#FFFFFF" topmargin=0" >\r\n'
+            '<table><tr><td class="mkt">DSE General Index</td></tr>\r\n'
+            '<tr><td><font size="1">Last update on %s</font></td></tr>'
+            '</table>\r\n</body></html>\r\n' % stamp)
+
+
+def dse_price_page(n, seed=0):
+    """Returns a latest_share_price_all.php like page with `n` companies."""
+    out = ['<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN">'
+           '\r\n<html><head><title>Dhaka Stock Exchange</title>\r\n'
+           '<script language="JavaScript">\r\n'
+           'document.write("<table><tr><td>not a price</td></tr></table>");'
+           '\r\n</script>\r\n</head>\r\n'
+           '<body bgcolor="#FFFFFF" leftmargin="0" topmargin=0" >\r\n'
+           '<table width="100%" border="0" cellpadding="1" cellspacing="1">'
+           '\r\n<tr bgcolor="#D4E2F7"><td width="4%"><font>#</font></td>']
+    for head in DSE_HEADS:
+        out.append('<td align="center"><b>&nbsp;%s&nbsp;</b></td>' % head)
+    out.append('</tr>\r\n')
+
+    for i, row in enumerate(quotes(n, seed)):
+        td = i % 7 == 3 and 'TD' or 'td'
+        out.append('<tr bgcolor="%s"><%s align="center">%d</%s>'
+                   '<td><a href="displayCompany.php?name=%s" class="abhead">'
+                   '%s</a></td>' % (('#FFFFFF', '#EFEFEF')[i % 2], td, i + 1,
+                                    td, row[0], row[0]))
+        for value in row[1:]:
+            if i % 3:
+                out.append('<td align="right"><font color="#000000">%s'
+                           '</font></td>' % value)
+            else:
+                out.append('<%s align="right">%s</%s>' % (td, value, td))
+        out.append('</tr>\r\n')
+
+    out.append('</table>\r\n<br/>\r\n<table><tr><td><font size="1">'
+               '* LTP = Last Trade Price</font></td></tr></table>\r\n'
+               '<!-- footer --></body></html>\r\n')
+    return ''.join(out)
+
+
+def cse_page(n, seed=0, last_update=DEFAULT_LAST_UPDATE):
+    """Returns a trade/top.htm like page with `n` companies."""
+    hour = last_update.hour % 12 or 12
+    stamp = '%s %d %d %d:%02d%s' % (last_update.strftime('%b'),
+                                    last_update.day, last_update.year, hour,
+                                    last_update.minute,
+                                    last_update.strftime('%p'))
+    out = ['<html>\r\n<head><title>CSE :: Trade Summary</title></head>\r\n'
+           '<body bgcolor="#ffffff">\r\n<pre>\r\n'
+           '           Chittagong Stock Exchange Ltd.\r\n'
+           '      Daily Trade Summary (Provisional)  Date: %s\r\n'
+           '</pre>\r\n<hr>\r\n<pre>\r\n'
+           'Company        Open       High        Low      Close Prev.Close'
+           '     Diff. Trades     Volume\r\n%s\r\n' % (stamp, '-' * 92)]
+
+    for i, row in enumerate(quotes(n, seed)):
+        code, ltp, high, low, close, ycp, change, trades, value, volume = row
+        out.append('%-12s %10.2f %10.2f %10.2f %10.2f %10.2f %9.2f %7d %10d '
+                   '\r\n' % (code, ycp, high, low, close, ycp, change,
+                             trades, volume))
+        if i % 50 == 49:
+            out.append('\r\n')
+
+    out.append('%s\r\nTotal Trades &amp; Volume: see summary\r\n</pre>\r\n'
+               '</body>\r\n</html>\r\n' % ('-' * 92))
+    return ''.join(out)
+
+
+def main():
+    parser = OptionParser("Usage: %prog (--dse N | --cse N | --index) "
+                          "[options]")
+    parser.add_option("-d", "--dse", type="int", dest="dse", metavar="N",
+                      help="generate a DSE price page with N companies")
+    parser.add_option("-c", "--cse", type="int", dest="cse", metavar="N",
+                      help="generate a CSE report with N companies")
+    parser.add_option("-i", "--index", action="store_true", dest="index",
+                      help="generate a DSE index page")
+    parser.add_option("-s", "--seed", type="int", dest="seed", default=0,
+                      help="random seed (default: 0)")
+    parser.add_option("-o", "--output", dest="output", metavar="FILE",
+                      help="write the page to FILE instead of stdout")
+    options, args = parser.parse_args()
+
+    if options.dse is not None:
+        page = dse_price_page(options.dse, options.seed)
+    elif options.cse is not None:
+        page = cse_page(options.cse, options.seed)
+    elif options.index:
+        page = dse_index_page()
+    else:
+        parser.error("one of --dse, --cse or --index is required")
+
+    if options.output:
+        f = open(options.output, 'wb')
+        try:
+            f.write(page)
+        finally:
+            f.close()
+    else:
+        sys.stdout.write(page)
+
+
+if __name__ == '__main__':
+    main()
@@ -49,30 +49,60 @@ __version__ = "0.2"
 __copyright__ = "\tPortions copyright (C) 2010 invarBrass\r\n"
 __copyright__ += "\tPortions copyright (C) 2010 M Nasimul Haque"
 
-import csv
+import cStringIO as StringIO
 import datetime
+# datetime.strptime() imports _strptime on first use, which is not thread
+# safe.  Import it before any capture thread gets to it.
+import _strptime
+import hashlib
+import httplib
+import json
 import os
 import re
-import cStringIO as StringIO
+import socket
+import sys
+import threading
+import time
 import urllib2
-from BeautifulSoup import BeautifulSoup
+import urlparse
 from optparse import OptionParser
 
+import bars
+import history
+import httpencoding
+import quotes
+import stockparser
+import tradingcal
+
 # Constants
 DSE_ROOT_URL = "http://www.dsebd.org/"
 DSE_LATEST_URL = DSE_ROOT_URL + "latest_share_price_all.php"
 CSE_ROOT_URL = "http://www.csebd.com/"
 CSE_LATEST_URL = CSE_ROOT_URL + "trade/top.htm"
 CSV_OUTPUT_DIR = os.path.join(os.path.realpath(os.path.dirname(__file__)), 'csv')
+STATE_FILENAME = '.dsnap-state'
+HISTORY_DIRNAME = 'history'
 
 
 # Global flags
 emit_csv_header = False
 process_dse_data = True
+process_all_exchanges = False
 verbose_mode = True
 csv_filename = ""
 filter_inactive_companies = True
 dump_data_screen = False
+parse_mode = None
+report_parse_savings = False
+time_strategy = stockparser.TIME_CONCURRENT
+run_as_daemon = False
+poll_interval = 60
+follow_trading_hours = True
+keep_history = True
+bar_intervals = []
+
+# Kept open connections to the exchanges, only used by the daemon.
+_connection_pool = None
 
 def show_banner():
     if verbose_mode:
@@ -84,7 +114,9 @@ def show_banner():
 
 def log_to_screen(msg):
     if verbose_mode:
-        print("[%s] %s" %(datetime.datetime.now().strftime("%H:%M:%S"), msg))
+        # One write per line, so lines of exchanges captured side by side
+        # do not get mixed up.
+        sys.stdout.write("[%s] %s\n" %(datetime.datetime.now().strftime("%H:%M:%S"), msg))
 
 def dump_records(rows):
     if dump_data_screen:
@@ -92,6 +124,35 @@ def dump_records(rows):
             s = ','.join(row)
             print(s)
 
+# What is remembered between runs: the HTTP validators of every page and
+# the last snapshot of every exchange.  Exchanges captured side by side
+# share it, so it is only changed and saved while holding _state_lock.
+_state = None
+_state_lock = threading.RLock()
+
+def load_state():
+    global _state
+    if _state is None:
+        try:
+            with open(os.path.join(CSV_OUTPUT_DIR, STATE_FILENAME)) as f:
+                _state = json.load(f)
+        except (IOError, ValueError):
+            _state = {}
+    return _state
+
+def save_state():
+    if _state is not None:
+        with _state_lock:
+            with open(os.path.join(CSV_OUTPUT_DIR, STATE_FILENAME), 'w') as f:
+                json.dump(_state, f)
+
+def log_parse_stats(stats, reparse):
+    log_to_screen("Parsed with " + str(stats))
+    if report_parse_savings and stats.mode != stockparser.PARSE_FULL:
+        full = stockparser.ParseStats()
+        reparse(full)
+        log_to_screen(stats.saving_over(full))
+
 def parse_options():
     usage = "Usage: %prog [options]"
     parser = OptionParser(usage)
@@ -99,7 +160,13 @@ def parse_options():
                         opt_emit_header=False,
                         opt_dont_prune=False,
                         opt_dump_data=False,
-                        opt_process_dse=True)
+                        opt_parse_stats=False,
+                        opt_process_dse=True,
+                        opt_process_all=False,
+                        opt_daemon=False,
+                        opt_trading_hours=True,
+                        opt_history=True,
+                        interval=60)
 
     parser.add_option("-e", "--header", dest="opt_emit_header",
                       action="store_true",
@@ -110,6 +177,10 @@ def parse_options():
     parser.add_option("-c", "--cse", dest="opt_process_dse",
                       action="store_false",
                       help="capture CSE snapshot (default: off)")
+    parser.add_option("-a", "--all", dest="opt_process_all",
+                      action="store_true",
+                      help="capture DSE and CSE snapshots at the same time "
+                           "(default: off)")
     parser.add_option("-f", "--file", dest="filename",
                       metavar="FILE",
                       help="save CSV data to FILE")
@@ -128,99 +199,435 @@ def parse_options():
                       action="store_true",
                       dest="opt_dont_prune",
                       help="do not filter out non-trading companies (default: off)")
+    parser.add_option("-m", "--parser", dest="parse_mode",
+                      choices=[stockparser.PARSE_STREAM,
+                               stockparser.PARSE_REGEX,
+                               stockparser.PARSE_STRAINED,
+                               stockparser.PARSE_FULL],
+                      metavar="MODE",
+                      help="parse pages with MODE: stream (DSE), regex (CSE), "
+                           "strained or full "
+                           "(default: cheapest mode the exchange supports)")
+    parser.add_option("-s", "--parse-stats",
+                      action="store_true",
+                      dest="opt_parse_stats",
+                      help="also do a full parse and report the time and "
+                           "parse tree saved (default: off)")
+    parser.add_option("-t", "--time-from", dest="time_strategy",
+                      choices=[stockparser.TIME_INDEX,
+                               stockparser.TIME_PARTIAL,
+                               stockparser.TIME_CONCURRENT],
+                      metavar="HOW",
+                      help="get the DSE update time by downloading the index "
+                           "page first (index), reading it only up to the "
+                           "time (partial) or downloading it along with the "
+                           "prices (concurrent) (default: concurrent)")
+    parser.add_option("-D", "--daemon",
+                      action="store_true",
+                      dest="opt_daemon",
+                      help="keep running and capture every INTERVAL seconds "
+                           "(default: off)")
+    parser.add_option("-i", "--interval", type="int", dest="interval",
+                      metavar="INTERVAL",
+                      help="seconds between captures of the daemon, only "
+                           "to start with unless -A is given (default: 60)")
+    parser.add_option("-A", "--around-the-clock",
+                      action="store_false",
+                      dest="opt_trading_hours",
+                      help="let the daemon poll every INTERVAL seconds even "
+                           "while the markets are closed (default: off)")
+    parser.add_option("-b", "--bars", dest="bars",
+                      metavar="MINUTES,...",
+                      help="let the daemon also write bars of every MINUTES "
+                           "of trading to a CSV file per exchange, interval "
+                           "and day (default: none)")
+    parser.add_option("--no-history",
+                      action="store_false",
+                      dest="opt_history",
+                      help="do not append the snapshots to the intraday "
+                           "history under csv/history (default: off)")
     (options, args)             = parser.parse_args()
+    if options.interval <= 0:
+        parser.error("the interval has to be at least a second")
+    try:
+        intervals = [int(minutes) for minutes in (options.bars or '').split(',') if minutes]
+    except ValueError:
+        parser.error("bar intervals are whole numbers of minutes")
+    if [minutes for minutes in intervals if minutes <= 0 or minutes > 24 * 60]:
+        parser.error("bar intervals have to be between a minute and a day")
+    if options.opt_process_all and options.filename:
+        parser.error("every exchange needs a CSV file of its own, "
+                     "-f can not be used with -a")
 
     global emit_csv_header, csv_filename, process_dse_data, verbose_mode, filter_inactive_companies, dump_data_screen
+    global parse_mode, report_parse_savings, time_strategy, process_all_exchanges
+    global run_as_daemon, poll_interval, follow_trading_hours, keep_history, bar_intervals
 
     emit_csv_header             = options.opt_emit_header
     csv_filename                = options.filename
     process_dse_data            = options.opt_process_dse
+    process_all_exchanges       = options.opt_process_all
     verbose_mode                = options.opt_verbose
     filter_inactive_companies   = not options.opt_dont_prune
     dump_data_screen            = options.opt_dump_data
+    parse_mode                  = options.parse_mode
+    report_parse_savings        = options.opt_parse_stats
+    run_as_daemon               = options.opt_daemon
+    poll_interval               = options.interval
+    follow_trading_hours        = options.opt_trading_hours
+    keep_history                = options.opt_history
+    bar_intervals               = intervals
+    if options.time_strategy:
+        time_strategy           = options.time_strategy
+
+class PooledResponse(object):
+    """A response read from a pooled connection, which goes back to the
+    pool once the whole page has been read."""
+
+    def __init__(self, pool, host, conn, resp):
+        self._pool = pool
+        self._host = host
+        self._conn = conn
+        self._resp = resp
+        self.code = resp.status
+
+    def info(self):
+        return self._resp.msg
+
+    def read(self, size=None):
+        if size is None or size < 0:
+            return self._resp.read()
+        return self._resp.read(size)
+
+    def close(self):
+        if self._conn is None:
+            return
+        if self._resp.isclosed() and not self._resp.will_close:
+            self._pool.put(self._host, self._conn)
+        else:
+            # Whatever is left of the page is in the way of the next
+            # request, do not bother reading it.
+            self._conn.close()
+        self._conn = None
+
+class ConnectionPool(object):
+    """Keeps the connections to every exchange open between downloads, so
+    that polling does not pay for a new connection every time.
+
+    Connections are HTTP/1.1 keep-alive ones, one per download in flight.
+    Answers other than 200 are raised as `urllib2.HTTPError`, redirects
+    are followed, so callers can treat it like `urllib2.urlopen`.
+    """
+
+    max_redirects = 5
+
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self.opened = 0
+        self.reused = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, host):
+        """Returns `(connection, reused)` for `host`."""
+        with self._lock:
+            idle = self._idle.get(host)
+            if idle:
+                self.reused += 1
+                return idle.pop(), True
+            self.opened += 1
+        return httplib.HTTPConnection(host, timeout=self.timeout), False
+
+    def put(self, host, conn):
+        with self._lock:
+            self._idle.setdefault(host, []).append(conn)
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle.clear()
+
+    def _request(self, host, path, headers):
+        while True:
+            conn, reused = self.get(host)
+            try:
+                conn.request('GET', path, headers=headers)
+                return conn, conn.getresponse()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                # The server may have dropped a connection that sat idle,
+                # only a fresh one failing is an error.
+                if not reused:
+                    raise
+
+    def urlopen(self, url, headers):
+        for i in xrange(self.max_redirects + 1):
+            scheme, host, path, query, fragment = urlparse.urlsplit(url)
+            if query:
+                path += '?' + query
+            conn, resp = self._request(host, path or '/', headers)
+            if resp.status == 200:
+                return PooledResponse(self, host, conn, resp)
+
+            body = StringIO.StringIO(resp.read())
+            PooledResponse(self, host, conn, resp).close()
+            location = resp.getheader('Location')
+            if resp.status not in (301, 302, 303, 307) or not location:
+                raise urllib2.HTTPError(url, resp.status, resp.reason, resp.msg, body)
+            url = urlparse.urljoin(url, location)
+        raise urllib2.HTTPError(url, resp.status, "Too many redirects", resp.msg, body)
 
 class AbstractStockExchangeHandler(object):
     _stock_exchange_name = ""
 
+    # What the last process() came up with, for the summary of -a and the
+    # schedule of the daemon.
+    csvname = None
+    last_update = None
+    total_companies = 0
+    inactive_companies = 0
+
     def __init__(self, stock_exchange):
         self._stock_exchange_name = stock_exchange
-
-    def download_html(self, url):
-        req = urllib2.Request(url)
-        req.add_header('Referer', url)
-        req.add_header('User-agent', 'Mozilla/5.0 (Windows; U; Windows NT 6.1; en-US; rv:1.9.2) Gecko/20100115 Firefox/3.6')
-        resp = urllib2.urlopen(req)
+        # One for every interval of bar_intervals, kept from one capture of
+        # the daemon to the next.
+        self._bar_builders = [bars.BarBuilder(minutes) for minutes in bar_intervals]
+        self._layout = None
+        # md5 of the page being captured and url: validators of the pages
+        # downloaded for it, kept once its snapshot is saved.
+        self._page_hash = None
+        self._validators = {}
+
+    def open_html(self, url, conditional=False):
+        """Returns the response for `url` to read the decoded page from, or
+        None if `conditional` and the page did not change since the last
+        snapshot was made from it."""
+        validators = load_state().get('validators', {})
+        headers = {
+            'Referer': url,
+            'User-agent': 'Mozilla/5.0 (Windows; U; Windows NT 6.1; en-US; rv:1.9.2) Gecko/20100115 Firefox/3.6',
+            'Accept-Encoding': httpencoding.ACCEPT_ENCODING,
+        }
+        if conditional and url in validators:
+            etag, last_modified = validators[url]
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        try:
+            if _connection_pool is not None:
+                resp = _connection_pool.urlopen(url, headers)
+            else:
+                resp = urllib2.urlopen(urllib2.Request(url, headers=headers))
+        except urllib2.HTTPError, e:
+            if e.code != 304:
+                raise
+            e.close()
+            return None
+        # Only kept along with the snapshot, a 304 must not stand for a
+        # page that never made it into one.
+        with _state_lock:
+            self._validators[url] = [resp.info().getheader('ETag'),
+                                     resp.info().getheader('Last-Modified')]
+        return httpencoding.DecodingReader(resp)
+
+    def download_html(self, url, conditional=False):
+        """Returns None if `conditional` and the page did not change since
+        it was last downloaded."""
+        resp = self.open_html(url, conditional)
+        if resp is None:
+            return None
         data = resp.read()
         resp.close()
+        log_to_screen("Downloaded %s: %s" % (url, resp.decoder))
         return data#.replace("\r", '').replace("\n", '')
 
+    def page_unchanged(self, page):
+        """Tells if `page` is byte for byte the page the last snapshot was
+        made from, and logs how often that happens."""
+        state = load_state()
+        self._page_hash = hashlib.md5(page).hexdigest()
+        with _state_lock:
+            unchanged = state.get('hashes', {}).get(self._stock_exchange_name) == self._page_hash
+
+            counts = state.setdefault('unchanged', {}).setdefault(self._stock_exchange_name, [0, 0])
+            counts[1] += 1
+            if unchanged:
+                counts[0] += 1
+        log_to_screen("Page unchanged on %d of %d downloads" % tuple(counts))
+        return unchanged
+
+    def get_last_snapshot(self):
+        """Returns `(last_update, csvname)` of the last snapshot still on
+        disk, or `(None, None)`."""
+        snapshot = load_state().get('snapshots', {}).get(self._stock_exchange_name)
+        if not snapshot or not os.path.exists(snapshot['csv']):
+            return None, None
+        return datetime.datetime.strptime(snapshot['last_update'], "%Y-%m-%dT%H:%M:%S"), snapshot['csv']
+
+    def save_snapshot(self, last_update, csvname, total_companies, inactive_companies):
+        self.csvname = csvname
+        self.last_update = last_update
+        self.total_companies = total_companies
+        self.inactive_companies = inactive_companies
+        with _state_lock:
+            load_state().setdefault('snapshots', {})[self._stock_exchange_name] = {
+                'last_update': last_update.strftime("%Y-%m-%dT%H:%M:%S"),
+                'csv': csvname,
+                'total': total_companies,
+                'inactive': inactive_companies,
+            }
+            if self._page_hash is not None:
+                load_state().setdefault('hashes', {})[self._stock_exchange_name] = self._page_hash
+            load_state().setdefault('validators', {}).update(self._validators)
+        save_state()
+
+    def record_history(self, snapshot):
+        """Appends every company of `snapshot` to the intraday history."""
+        if not keep_history:
+            return
+        store = history.History(os.path.join(CSV_OUTPUT_DIR, HISTORY_DIRNAME))
+        if store.append(self._stock_exchange_name, snapshot):
+            log_to_screen("Snapshot appended to the %s history" % self._stock_exchange_name.upper())
+
+    def record_bars(self, snapshot):
+        """Feeds `snapshot` to the bar builders and saves the bars they are
+        done with."""
+        self._layout = snapshot.layout
+        for builder in self._bar_builders:
+            self.save_bars(builder, builder.add(snapshot))
+
+    def finish_bars(self):
+        """Saves the bars of the intervals in progress."""
+        for builder in self._bar_builders:
+            self.save_bars(builder, builder.flush())
+
+    def save_bars(self, builder, finished):
+        if not finished:
+            return
+        csvname = r'%s%s%s-%dm-%s.csv' % (CSV_OUTPUT_DIR, os.sep, self._stock_exchange_name, builder.minutes, finished[0].start.strftime("%y-%m-%d"))
+        heads = emit_csv_header and not os.path.exists(csvname) and bars.BAR_HEADS
+        with open(csvname, 'ab') as f:
+            f.write(stockparser.to_csv(bars.to_rows(finished, self._layout, r"%Y-%m-%d"), heads))
+        log_to_screen("%d %d minute bars written to %s" % (len(finished), builder.minutes, os.path.basename(csvname)))
+
+    def reuse_snapshot(self, reason):
+        """Reports the last snapshot as the result of this capture."""
+        save_state()
+        snapshot = load_state()['snapshots'][self._stock_exchange_name]
+        self.csvname = snapshot['csv']
+        self.last_update = datetime.datetime.strptime(snapshot['last_update'], "%Y-%m-%dT%H:%M:%S")
+        self.total_companies = snapshot.get('total', 0)
+        self.inactive_companies = snapshot.get('inactive', 0)
+        log_to_screen("%s data %s, CSV data is in %s" % (self._stock_exchange_name.upper(), reason, os.path.basename(self.csvname)))
+
+    def get_parse_mode(self, modes):
+        return parse_mode in modes and parse_mode or modes[0]
+
     def get_filename(self, last_update_time):
         return r'%s%s%s-%s.csv' % (CSV_OUTPUT_DIR, os.sep, self._stock_exchange_name, last_update_time.strftime("%y-%m-%d_%H-%M"))
 
     def process(): abstract
 
-class DSEHandler(AbstractStockExchangeHandler):
+class Task(threading.Thread):
+    """Runs `func(*args)` on a thread of its own while the caller gets on
+    with something else."""
+
+    def __init__(self, func, *args):
+        threading.Thread.__init__(self)
+        self.func = func
+        self.args = args
+        self.value = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.value = self.func(*self.args)
+        except Exception:
+            self.error = sys.exc_info()
+
+    def result(self):
+        """Waits for `func` and returns what it returned, or raises what it
+        raised."""
+        self.join()
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.value
 
-    _RE_HTML_BODY_SANITIZER = re.compile(r'<body[^>]*>')
-    _RE_DSE_DATE = re.compile(r'[a-zA-Z]{3}\s*\d{2},\s*\d{4}\s*at\s*\d{2}:\d{2}:\d{2}')
+class DSEHandler(AbstractStockExchangeHandler):
 
     def __init__(self):
         super(self.__class__,self).__init__("dse")
 
     def _get_last_update_time(self):
         last_update = datetime.datetime.now()
-        response = super(self.__class__,self).download_html(DSE_ROOT_URL)
-
-        if len(response) > 0:
-            tmp = self._RE_DSE_DATE.search(response).group()
-            tmp = tmp.replace(' ', '')
-            last_update = datetime.datetime.strptime(tmp, "%b%d,%Yat%H:%M:%S")
-
+        last_snapshot_time = self.get_last_snapshot()[0]
+        conditional = last_snapshot_time is not None
+
+        if time_strategy == stockparser.TIME_PARTIAL:
+            resp = super(self.__class__,self).open_html(DSE_ROOT_URL, conditional)
+            if resp is None:
+                return last_snapshot_time
+            tmp, bytes_read = stockparser.read_dse_time(resp)
+            resp.close()
+            log_to_screen("Read %d bytes of the DSE index page, %s" % (bytes_read, resp.decoder))
+        else:
+            response = super(self.__class__,self).download_html(DSE_ROOT_URL, conditional)
+            if response is None:
+                return last_snapshot_time
+            tmp = stockparser.parse_dse_time(response)
+
+        if tmp is not None:
+            last_update = tmp
         return last_update
 
     def process(self):
+        self._validators = {}
+        cached_csvname = self.get_last_snapshot()[1]
+        prices = None
+        if time_strategy == stockparser.TIME_CONCURRENT:
+            log_to_screen("Downloading transaction data from DSE...")
+            prices = Task(self.download_html, DSE_LATEST_URL, cached_csvname is not None)
+            prices.start()
+
         log_to_screen("Retrieving the last update time from DSE index page...")
         last_update = self._get_last_update_time()
         log_to_screen("DSE Last updated on " + last_update.isoformat())
         csvname =  (csv_filename != "") and csv_filename or super(self.__class__,self).get_filename(last_update)
 
-        log_to_screen("Downloading transaction data from DSE...")
-        dseresult = super(self.__class__,self).download_html(DSE_LATEST_URL)
+        if prices is not None:
+            dseresult = prices.result()
+        else:
+            log_to_screen("Downloading transaction data from DSE...")
+            dseresult = super(self.__class__,self).download_html(DSE_LATEST_URL, cached_csvname is not None)
+
+        if dseresult is None:
+            self.reuse_snapshot("not modified")
+            return
 
         if len(dseresult) <= 0:
             print("ERROR! There was an error fetching data from server.")
             return
 
+        if self.page_unchanged(dseresult) and cached_csvname is not None:
+            self.reuse_snapshot("unchanged")
+            return
+
         log_to_screen("Download completed. Parsing data...")
-        soup = BeautifulSoup(self._RE_HTML_BODY_SANITIZER.sub('<body>', dseresult))
-        headtr = soup.body.table.tr.findAll('b')
-
-        output = StringIO.StringIO()
-        csvformatter = csv.writer(output)
-
-        if emit_csv_header:
-            heads = []
-            for h in headtr:
-                heads.append(str(h.contents[0]).replace('&nbsp;', '').strip())
-
-            heads.insert(1, "Date")
-            heads.insert(2, "Time")
-            csvformatter.writerow(heads)
-
-        total_companies, inactive_companies = 0, 0
-        all_rows = []
-        data = soup.body.table.findAll('tr')[1:]
-        for row in data:
-            row = row.findAll('td')[1:]
-            d = [row[0].a.contents[0], last_update.strftime(r"%Y-%m-%d"), last_update.strftime(r"%H:%M:%S")]
-            for col in row[1:]:
-                d.append(col.find(text=True))
-
-            total_companies += 1
-            if (d[-1] == '0') and (filter_inactive_companies):
-                inactive_companies += 1
-            else:
-                all_rows.append(d)
+        stats = stockparser.ParseStats()
+        heads, data = stockparser.parse_dse(dseresult, self.get_parse_mode(stockparser.DSE_PARSE_MODES), stats)
+        log_parse_stats(stats, lambda full: stockparser.parse_dse(dseresult, stockparser.PARSE_FULL, full))
+        if not data:
+            # An error or maintenance page, the last snapshot stays.
+            print("ERROR! There are no prices on the DSE page.")
+            return
+
+        snapshot = quotes.DSE.snapshot(data, last_update)
+        del data
+        all_rows, inactive_companies = quotes.to_rows(snapshot, r"%Y-%m-%d", filter_inactive_companies)
+        total_companies = len(snapshot)
 
         log_to_screen("Completed analysis")
         log_to_screen("Quick stats:")
@@ -228,48 +635,51 @@ class DSEHandler(AbstractStockExchangeHandler):
         log_to_screen("\tActive Companies: " + str(total_companies - inactive_companies))
         log_to_screen("\tInactive Companies: " + str(inactive_companies))
 
-        csvformatter.writerows(all_rows)
-        csvdata = output.getvalue()
-        output.close()
+        csvdata = stockparser.to_csv(all_rows, emit_csv_header and stockparser.stamp_heads(heads))
 
         log_to_screen("CSV data written to " +  os.path.basename(csvname))
 
         with open(csvname, 'wb') as f:
             f.write(csvdata)
+        self.save_snapshot(last_update, csvname, total_companies, inactive_companies)
+        self.record_history(snapshot)
+        self.record_bars(snapshot)
 
         dump_records(all_rows)
 
 
 class CSEHandler(AbstractStockExchangeHandler):
     _RE_CSE_DATE = re.compile(r'Date: '
-                           r'([a-zA-Z]{3})\s*(\d{2})\s*(\d{4})\s*(\d{1,2}):(\d{1,2})(AM|PM)')
-    _RE_CSE_TABLE_DATA = re.compile(r'^\s*(\w+).*?'
-                           '(\d+\.{0,1}\d*)\s+'
-                           '(\d+\.{0,1}\d*)\s+'
-                           '(\d+\.{0,1}\d*)\s+'
-                           '(\d+\.{0,1}\d*)\s+'
-                           '(\d+\.{0,1}\d*)\s+'
-                           '(-{0,1}\d+\.{0,1}\d*)\s+'
-                           '(\d+\.{0,1}\d*)\s+'
-                           '(\d+\.{0,1}\d*)\s+', re.MULTILINE)
+                           r'([a-zA-Z]{3})\s*(\d{1,2})\s*(\d{4})\s*(\d{1,2}):(\d{1,2})(AM|PM)')
 
     def __init__(self):
         super(self.__class__,self).__init__("cse")
 
     def process(self):
+        self._validators = {}
         log_to_screen("Downloading transaction data from CSE...")
-        cse_html_page = super(self.__class__,self).download_html(CSE_LATEST_URL)
+        cached_csvname = self.get_last_snapshot()[1]
+        cse_html_page = super(self.__class__,self).download_html(CSE_LATEST_URL, cached_csvname is not None)
         last_update = datetime.datetime.now()
 
+        if cse_html_page is None:
+            self.reuse_snapshot("not modified")
+            return
+
         if len(cse_html_page) <= 0:
             print("ERROR! There was an error fetching data from server.")
             return
 
+        if self.page_unchanged(cse_html_page) and cached_csvname is not None:
+            self.reuse_snapshot("unchanged")
+            return
+
         log_to_screen("Download completed. Parsing data...")
-        soup = BeautifulSoup(cse_html_page)
-        precontents = soup.body.findAll('pre')
+        stats = stockparser.ParseStats()
+        precontents = stockparser.parse_cse(cse_html_page, self.get_parse_mode(stockparser.CSE_PARSE_MODES), stats)
+        log_parse_stats(stats, lambda full: stockparser.parse_cse(cse_html_page, stockparser.PARSE_FULL, full))
 
-        sdate = list(self._RE_CSE_DATE.search(precontents[0].contents[0]).groups())
+        sdate = list(self._RE_CSE_DATE.search(precontents[0]).groups())
         for i in [1, 3, 4]:
             if len(sdate[i]) == 1:
                 sdate[i] = '0' + sdate[i]
@@ -279,47 +689,123 @@ class CSEHandler(AbstractStockExchangeHandler):
 
         csvname =  (csv_filename != "") and csv_filename or super(self.__class__,self).get_filename(last_update)
 
-        output = StringIO.StringIO()
-        csvformatter = csv.writer(output)
-
-        if emit_csv_header:
-            heads = ['Company', 'Date', 'Time', 'Open', 'High', 'Low', 'Close',
-                     'Prev. Close', 'Difference', 'Trades', 'Volume',]
-            csvformatter.writerow(heads)
-
-        all_rows = []
-        contents = precontents[1].contents[0].split('\n')
-        total_companies, inactive_companies = 0, 0
-        for content in contents:
-            try:
-                data = list(self._RE_CSE_TABLE_DATA.search(content).groups())
-                total_companies += 1
-                if (data[-1] == '0') and (filter_inactive_companies):
-                    inactive_companies += 1
-                    continue
-                data.insert(1, last_update.strftime(r"%Y-%m-%d"))
-                data.insert(2, last_update.strftime(r"%H:%M:%S"))
-                sss = data[-1]
-                all_rows.append(data)
-            except:
-                pass
+        data_rows, rejected_lines = stockparser.parse_cse_rows(precontents[1])
+        if not data_rows:
+            print("ERROR! There are no prices on the CSE page.")
+            return
+        snapshot = quotes.CSE.snapshot(data_rows, last_update)
+        del data_rows
+        all_rows, inactive_companies = quotes.to_rows(snapshot, r"%Y-%m-%d", filter_inactive_companies)
+        total_companies = len(snapshot)
 
         log_to_screen("Completed parsing")
         log_to_screen("Quick stats:")
         log_to_screen("\tTotal Companies: " + str(total_companies))
         log_to_screen("\tActive Companies: " + str(total_companies - inactive_companies))
         log_to_screen("\tInactive Companies: " + str(inactive_companies))
+        log_to_screen("\tRejected Lines: " + str(rejected_lines))
 
-        csvformatter.writerows(all_rows)
-        csvdata = output.getvalue()
-        output.close()
+        csvdata = stockparser.to_csv(all_rows, emit_csv_header and stockparser.CSE_HEADS)
 
         with open(csvname, 'wb') as f:
             f.write(csvdata)
+        self.save_snapshot(last_update, csvname, total_companies, inactive_companies)
+        self.record_history(snapshot)
+        self.record_bars(snapshot)
 
         log_to_screen("CSV data written to " +  os.path.basename(csvname))
         dump_records(all_rows)
 
+def capture_all(handlers):
+    """Captures the exchanges of `handlers` side by side, so the run takes
+    as long as the slowest exchange, and sums up what they captured."""
+    load_state()
+    start = time.time()
+    for handler in handlers:
+        handler.csvname = None
+    tasks = [Task(handler.process) for handler in handlers]
+    for task in tasks:
+        task.start()
+
+    total = inactive = 0
+    failed = []
+    for handler, task in zip(handlers, tasks):
+        try:
+            task.result()
+        except Exception, e:
+            print("ERROR! Capturing %s failed: %s" % (handler._stock_exchange_name.upper(), e))
+        if handler.csvname is None:
+            failed.append(handler._stock_exchange_name.upper())
+            continue
+        total += handler.total_companies
+        inactive += handler.inactive_companies
+
+    log_to_screen("Captured %d of %d exchanges in %.2f seconds" % (len(handlers) - len(failed), len(handlers), time.time() - start))
+    log_to_screen("Combined stats:")
+    for handler in handlers:
+        if handler.csvname is not None:
+            log_to_screen("\t%s: %s" % (handler._stock_exchange_name.upper(), os.path.basename(handler.csvname)))
+    log_to_screen("\tTotal Companies: " + str(total))
+    log_to_screen("\tActive Companies: " + str(total - inactive))
+    log_to_screen("\tInactive Companies: " + str(inactive))
+    if failed:
+        log_to_screen("\tFailed: " + ', '.join(failed))
+
+def run_daemon(capture, handlers, interval):
+    """Calls `capture()` every `interval` seconds until interrupted, over
+    connections kept open from one poll to the next.
+
+    Unless told to poll around the clock, it sleeps while the markets are
+    closed and, while they are open, polls about when the exchanges of
+    `handlers` are due to publish their next prices.
+    """
+    global _connection_pool
+    _connection_pool = ConnectionPool()
+    calendar = tradingcal.TradingCalendar()
+    cadences = [tradingcal.UpdateCadence(default=interval, minimum=min(interval, 30)) for handler in handlers]
+    if follow_trading_hours:
+        log_to_screen("Polling in trading hours, every %d seconds to start with, press Ctrl+C to stop" % interval)
+    else:
+        log_to_screen("Polling every %d seconds, press Ctrl+C to stop" % interval)
+    next_poll = time.time()
+    try:
+        while True:
+            if follow_trading_hours and not calendar.is_open(tradingcal.dhaka_now()):
+                # The last bars of the session are done with.
+                for handler in handlers:
+                    handler.finish_bars()
+                wait = tradingcal.seconds_to_next_poll(calendar, cadences)
+                log_to_screen("Markets are closed, next poll in %s" % datetime.timedelta(seconds=wait))
+                time.sleep(wait)
+                continue
+
+            try:
+                capture()
+            except Exception, e:
+                print("ERROR! Capture failed: %s" % e)
+            log_to_screen("Connections opened: %d, reused: %d" % (_connection_pool.opened, _connection_pool.reused))
+
+            if follow_trading_hours:
+                for handler, cadence in zip(handlers, cadences):
+                    cadence.observe(handler.last_update)
+                wait = tradingcal.seconds_to_next_poll(calendar, cadences)
+                log_to_screen("Next poll in %d seconds" % wait)
+                time.sleep(wait)
+                continue
+
+            next_poll += interval
+            now = time.time()
+            if next_poll < now:
+                # The capture overran, skip the polls it missed instead of
+                # running them back to back.
+                next_poll += (int((now - next_poll) / interval) + 1) * interval
+            time.sleep(next_poll - now)
+    except KeyboardInterrupt:
+        log_to_screen("Stopped")
+    finally:
+        _connection_pool.close()
+        _connection_pool = None
+
 def main():
     parse_options()
     show_banner()
@@ -327,8 +813,17 @@ def main():
     if not  os.path.isdir(CSV_OUTPUT_DIR):
         os.mkdir(CSV_OUTPUT_DIR)
 
-    handler = DSEHandler() if process_dse_data else CSEHandler()
-    handler.process()
+    if process_all_exchanges:
+        handlers = [DSEHandler(), CSEHandler()]
+        capture = lambda: capture_all(handlers)
+    else:
+        handlers = [DSEHandler() if process_dse_data else CSEHandler()]
+        capture = handlers[0].process
+
+    if run_as_daemon:
+        run_daemon(capture, handlers, poll_interval)
+    else:
+        capture()
 
 if __name__ == '__main__':
   main()
\ No newline at end of file
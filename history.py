@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+"""Append-only intraday history of the DSE and CSE snapshots.
+
+Used by the dsnap.py command line tool; App Engine has no file system to
+keep it on.  Every snapshot is appended to a data file per exchange and
+day, one fixed-width record per company, and the update time it is of
+goes into an index file next to it:
+
+    <root>/dse/2010-10-03.dat   records, RECORD.size bytes each
+    <root>/dse/2010-10-03.idx   (update time, first record, records)
+
+Days are read through mmap.  With numpy the columns of every snapshot are
+views into the mapped file, so a whole session loads without copying or
+unpacking anything.
+"""
+
+__author__ = "M Nasimul Haque (nasim.haque@gmail.com)"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2010 M Nasimul Haque"
+__license__ = "New-style BSD"
+
+import array
+import bisect
+import calendar
+import datetime
+import mmap
+import os
+import struct
+
+import quotes
+from quotes import numpy
+
+
+LAYOUTS = {'dse': quotes.DSE, 'cse': quotes.CSE}
+
+# Every price field of a Quote, whatever the exchange publishes.
+FIELDS = ('open', 'ltp', 'high', 'low', 'close', 'ycp', 'change', 'trades',
+          'value', 'volume')
+_COUNTS = ('trades', 'volume')
+
+# Symbols longer than SYMBOL_SIZE bytes are cut short.
+SYMBOL_SIZE = 16
+RECORD = struct.Struct('<%dsq%s' % (SYMBOL_SIZE, ''.join(
+    [field in _COUNTS and 'q' or 'd' for field in FIELDS])))
+INDEX_RECORD = struct.Struct('<qqq')
+
+if numpy is not None:
+    _RECORD_DTYPE = numpy.dtype(
+        [('symbol', 'S%d' % SYMBOL_SIZE), ('time', '<i8')] +
+        [(field, field in _COUNTS and '<i8' or '<f8') for field in FIELDS])
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_NAN = float('nan')
+
+
+def _timestamp(when):
+    return calendar.timegm(when.timetuple())
+
+
+def _datetime(timestamp):
+    return _EPOCH + datetime.timedelta(seconds=timestamp)
+
+
+def _read_file(filename):
+    try:
+        f = open(filename, 'rb')
+    except IOError:
+        return ''
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+class History(object):
+    """The history kept under the directory `root`."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _filenames(self, exchange, day):
+        name = os.path.join(self.root, exchange, day.strftime('%Y-%m-%d'))
+        return name + '.dat', name + '.idx'
+
+    def index(self, exchange, day):
+        """Returns `(last_update, first record, records)` of every snapshot
+        of `exchange` on `day`, oldest first."""
+        data = _read_file(self._filenames(exchange, day)[1])
+        size = INDEX_RECORD.size
+        entries = []
+        for offset in xrange(0, len(data) - len(data) % size, size):
+            timestamp, first, count = INDEX_RECORD.unpack_from(data, offset)
+            entries.append((_datetime(timestamp), first, count))
+        return entries
+
+    def days(self, exchange):
+        """Returns the days there is history of `exchange` for."""
+        try:
+            names = os.listdir(os.path.join(self.root, exchange))
+        except OSError:
+            return []
+        return sorted([datetime.datetime.strptime(name[:-4], '%Y-%m-%d').date()
+                       for name in names if name.endswith('.idx')])
+
+    def append(self, exchange, snapshot):
+        """Appends `snapshot` of `exchange`.  Returns the number of records
+        written, 0 if a snapshot as new is already there."""
+        day = snapshot.last_update.date()
+        data_name, index_name = self._filenames(exchange, day)
+        entries = self.index(exchange, day)
+        if entries and entries[-1][0] >= snapshot.last_update:
+            return 0
+
+        directory = os.path.dirname(data_name)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        first = entries and entries[-1][1] + entries[-1][2] or 0
+        timestamp = _timestamp(snapshot.last_update)
+        columns = [snapshot.columns.get(field) for field in FIELDS]
+        records = []
+        for i, symbol in enumerate(snapshot.symbols):
+            values = []
+            for field, column in zip(FIELDS, columns):
+                if field in _COUNTS:
+                    values.append(column is None and quotes.MISSING_COUNT or
+                                  int(column[i]))
+                else:
+                    values.append(column is None and _NAN or float(column[i]))
+            records.append(RECORD.pack(symbol[:SYMBOL_SIZE], timestamp,
+                                       *values))
+
+        f = open(data_name, 'ab')
+        try:
+            # Drop whatever an append that died before its index entry
+            # left behind.
+            f.truncate(first * RECORD.size)
+            f.seek(0, 2)
+            f.write(''.join(records))
+        finally:
+            f.close()
+        # The index entry goes last, readers never see a snapshot that is
+        # not all there.
+        f = open(index_name, 'ab')
+        try:
+            # And after the last whole entry, not after a torn one.
+            f.truncate(len(entries) * INDEX_RECORD.size)
+            f.seek(0, 2)
+            f.write(INDEX_RECORD.pack(timestamp, first, len(records)))
+        finally:
+            f.close()
+        return len(records)
+
+    def _map(self, exchange, day):
+        """Returns the data file of `day` memory mapped, None if there are
+        no records."""
+        try:
+            f = open(self._filenames(exchange, day)[0], 'rb')
+        except IOError:
+            return None
+        try:
+            if not os.fstat(f.fileno()).st_size:
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+    def session(self, exchange, day):
+        """Returns the snapshots of `exchange` on `day`, oldest first."""
+        entries = self.index(exchange, day)
+        mapped = entries and self._map(exchange, day)
+        if not mapped:
+            return []
+        layout = LAYOUTS[exchange]
+        # Only the records the index vouches for.
+        end = entries[-1][1] + entries[-1][2]
+
+        snapshots = []
+        if numpy is not None:
+            # The columns are views into the mapped file, which stays
+            # mapped for as long as any of them is around.
+            records = numpy.frombuffer(mapped, dtype=_RECORD_DTYPE,
+                                       count=end)
+            for last_update, first, count in entries:
+                rows = records[first:first + count]
+                snapshots.append(quotes.Snapshot(
+                    layout, last_update,
+                    rows['symbol'].tolist(),
+                    dict((field, rows[field]) for field in layout.fields)))
+            return snapshots
+
+        try:
+            positions = [FIELDS.index(field) + 2 for field in layout.fields]
+            for last_update, first, count in entries:
+                rows = [RECORD.unpack_from(mapped, i * RECORD.size)
+                        for i in xrange(first, first + count)]
+                columns = {}
+                for field, position in zip(layout.fields, positions):
+                    columns[field] = array.array(
+                        field in _COUNTS and 'l' or 'd',
+                        [row[position] for row in rows])
+                snapshots.append(quotes.Snapshot(
+                    layout, last_update,
+                    [row[0].rstrip('\0') for row in rows], columns))
+        finally:
+            mapped.close()
+        return snapshots
+
+    def snapshot(self, exchange, when):
+        """Returns the last snapshot of `exchange` as of `when`, on the day
+        of `when`, or None if there is none."""
+        snapshots = self.session(exchange, when.date())
+        times = [snapshot.last_update for snapshot in snapshots]
+        i = bisect.bisect_right(times, when)
+        if not i:
+            return None
+        return snapshots[i - 1]
+
+    def symbol(self, exchange, day, symbol):
+        """Returns the Quotes of `symbol` on `day`, oldest first."""
+        found = []
+        for snapshot in self.session(exchange, day):
+            try:
+                i = snapshot.symbols.index(symbol)
+            except ValueError:
+                continue
+            found.append(snapshot.quote(i))
+        return found
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+"""gzip and deflate content coding for the exchange page downloads."""
+
+__author__ = "M Nasimul Haque (nasim.haque@gmail.com)"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2010 M Nasimul Haque"
+__license__ = "New-style BSD"
+
+import zlib
+
+
+ACCEPT_ENCODING = 'gzip, deflate'
+
+_READ_SIZE = 8 * 1024
+
+
+class Decoder(object):
+    """Incremental decoder for one response body.
+
+    `encoding` is the Content-Encoding of the response; anything but gzip
+    and deflate is passed through untouched.
+    """
+
+    def __init__(self, encoding=None):
+        self.encoding = (encoding or 'identity').strip().lower()
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        if self.encoding in ('gzip', 'x-gzip'):
+            # 16 + MAX_WBITS makes zlib expect and skip the gzip header.
+            self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == 'deflate':
+            self._zlib = zlib.decompressobj()
+            self._first = True
+        else:
+            self._zlib = None
+
+    def decode(self, data):
+        self.wire_bytes += len(data)
+        if self._zlib is not None and data:
+            if self.encoding == 'deflate' and self._first:
+                self._first = False
+                try:
+                    data = self._zlib.decompress(data)
+                except zlib.error:
+                    # Plenty of servers send deflate without the zlib
+                    # header, as the raw stream.
+                    self._zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+                    data = self._zlib.decompress(data)
+            else:
+                data = self._zlib.decompress(data)
+        self.decoded_bytes += len(data)
+        return data
+
+    def flush(self):
+        data = ''
+        if self._zlib is not None:
+            data = self._zlib.flush()
+        self.decoded_bytes += len(data)
+        return data
+
+    def saved(self):
+        """Share of the page that did not have to come over the wire."""
+        if not self.decoded_bytes:
+            return 0.0
+        return 1 - float(self.wire_bytes) / self.decoded_bytes
+
+    def __str__(self):
+        return '%d bytes %s for %d bytes of page (%.0f%% saved)' % (
+            self.wire_bytes, self.encoding, self.decoded_bytes,
+            self.saved() * 100)
+
+
+def accepts(accept_encoding, coding):
+    """Tells if a client sending the Accept-Encoding header
+    `accept_encoding` takes responses in the content coding `coding`."""
+    star = False
+    for item in (accept_encoding or '').split(','):
+        params = item.split(';')
+        name = params[0].strip().lower()
+        q = 1.0
+        for param in params[1:]:
+            key, sep, value = param.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name == coding:
+            return q > 0
+        if name == '*':
+            star = q > 0
+    return star
+
+
+def decode(body, encoding):
+    """Returns `(page, decoder)` for a whole response `body`."""
+    decoder = Decoder(encoding)
+    page = decoder.decode(body) + decoder.flush()
+    return page, decoder
+
+
+class DecodingReader(object):
+    """File like wrapper that decodes a urllib2 response as it is read.
+
+    Reading only the start of the page only downloads and inflates about
+    as much of it.
+    """
+
+    def __init__(self, resp):
+        self.resp = resp
+        self.decoder = Decoder(resp.info().getheader('Content-Encoding'))
+        self._buffer = ''
+        self._eof = False
+
+    def info(self):
+        return self.resp.info()
+
+    def _fill(self, size):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            data = self.resp.read(_READ_SIZE)
+            if data:
+                self._buffer += self.decoder.decode(data)
+            else:
+                self._buffer += self.decoder.flush()
+                self._eof = True
+
+    def read(self, size=-1):
+        self._fill(size)
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        self.resp.close()
@@ -5,18 +5,33 @@ __version__ = "0.1"
 __copyright__ = "Copyright (c) 2010 M Nasimul Haque"
 __license__ = "New-style BSD"
 
-import csv
 import datetime
+import email.utils
+import hashlib
 import os
 import logging
 import re
-import StringIO
+import time
 
 from google.appengine.ext import webapp
 from google.appengine.ext.webapp import util, template
 
 from google.appengine.api import urlfetch, memcache
-from BeautifulSoup import BeautifulSoup
+try:
+    from google.appengine.api import taskqueue
+except ImportError:
+    from google.appengine.api.labs import taskqueue
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+import httpencoding
+import quotes
+import snapcache
+import snappack
+import stockparser
+import tradingcal
 
 
 dseroot = "http://www.dsebd.org/"
@@ -26,15 +41,58 @@ cselatest = "http://www.csebd.com/trade/top.htm"
 
 fetch_error_message = 'Sorry, there was an error fetching data from main server.'
 
-dse_key = 'dsedata'
-dsedate_key = 'dsedate'
-dse_last_saved_key = 'dselastsaved'
-cse_key = 'csedata'
-csedate_key = 'csedate'
+# Everything about the snapshot of an exchange is one memcache value, so a
+# request reads it with one call and a refresh writes it with another.  See
+# `_load_snapshot`.
+snapshot_key = 'snapshot-%s'
+# exchange, version, number of a chunk of a snapshot too big to go into the
+# record itself.
+chunk_key = 'snapshot-%s-%s-%d'
+# A snapshot packing into one chunk of up to inline_chunk_size bytes is kept
+# in the record, which saves a memcache call per read.  Bigger chunks would
+# leave the stats, updates and validators short of room under the 1MB a
+# memcache value can take.
+inline_chunk_size = 256 * 1024
+page_fetches_key = 'pagefetches-%s'
+page_unchanged_key = 'pageunchanged-%s'
+lease_key = 'lease-%s'
+refreshes_key = 'refreshes-%s'
+coalesced_key = 'coalesced-%s'
+revalidate_key = 'revalidate-%s'
 cache_time = 1 * 60
+# Past its cache time a snapshot is served to be revalidated.  Once it was
+# last checked against the exchange max_staleness ago, when cron is not
+# keeping up, the reader queues a refresh too.
+max_staleness = 10 * 60
+# A refresh taking longer than lease_time is given up on and another
+# request may start one.  Readers finding no snapshot at all wait up to
+# lease_wait for the refresh they queued.
+lease_time = 30
+lease_wait = 5
+lease_poll = 0.25
+# Companies in every top list of /dse/stats and /cse/stats.
+stats_top = 10
 
 TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
 
+calendar = tradingcal.TradingCalendar()
+
+# The snapshot records this instance read from memcache, under the exchange
+# name, for snapshot_ttl seconds.  Under `(exchange, version)` the CSV of
+# that version, unpacked, for as long as there is room.
+snapshot_ttl = 5
+snapshots = snapcache.LRUCache(maxsize=8, ttl=snapshot_ttl)
+
+dse_parse_mode = stockparser.PARSE_STREAM
+# urlfetch hands over whole pages, so TIME_PARTIAL is not on offer here.
+# TIME_CONCURRENT has the prices sooner when there is an update, but most
+# polls find none and it downloads the price page for nothing on them.
+# Only cron and the task queue refresh, nobody waits on them.
+dse_time_strategy = stockparser.TIME_INDEX
+cse_parse_mode = stockparser.PARSE_REGEX
+csedatere = re.compile(r'Date: '
+                       r'([a-zA-Z]{3})\s*(\d{1,2})\s*(\d{4})\s*(\d{1,2}):(\d{1,2})(AM|PM)')
+
 def render(template_name, template_values):
     template_path = os.path.join(TEMPLATE_DIR, template_name)
     return template.render(template_path, template_values)
@@ -45,148 +103,640 @@ def _set_csv_header(headers, csvname):
     headers['Content-Type'] = 'text/csv'
 
 
-class DSEHandler(webapp.RequestHandler):
+def _load_snapshot(exchange, unpack=True):
+    """Returns the memcache record of the snapshot of `exchange`, a dict
+    that has, once known:
+
+    csv
+        The snapshot, put together from `manifest` and its chunks.
+    gzip
+        The snapshot gzip encoded, made from the packed CSV.
+    stats
+        The market summary of the snapshot, as JSON.
+    saved
+        The update time the snapshot is of, the one in its rows.
+    current
+        The last update time the exchange reported that the snapshot was
+        found to be still up to date with, see `_current`.
+    seen
+        The update time the exchange last reported.
+    fresh_until
+        Until when, in `time.time()`, `seen` is not asked for again.
+    checked
+        When, in `time.time()`, the snapshot was last checked against the
+        exchange.
+    updates
+        The update times the cadence of the exchange is learned from.
+    validators
+        url: `(ETag, Last-Modified)` of its last download.
+    page_hash
+        md5 of the price page the snapshot was made from.
+
+    In memcache the CSV is packed by snappack, the `chunk` of a snapshot
+    packing into one small one is kept in the record, others under
+    chunk_key.
+    Unless `unpack`, `csv` and `gzip` are left out and the manifest is not
+    checked against the chunks.
+    """
+    record = memcache.get(snapshot_key % exchange) or {}
+    if unpack and record.get('manifest') is not None:
+        bodies = _load_csv(exchange, record)
+        if bodies is None:
+            logging.warning('%s snapshot %s is incomplete' % (
+                exchange, record['manifest']['version']))
+            del record['manifest']
+            record.pop('chunk', None)
+        else:
+            record['csv'], record['gzip'] = bodies
+    return record
+
+
+def _load_csv(exchange, record):
+    """Returns `(csv, gzip)`, the CSV the manifest of `record` is of and the
+    same gzip encoded, or None if it cannot be put together any more."""
+    manifest = record['manifest']
+    key = (exchange, manifest['version'])
+    bodies = snapshots.get(key)
+    if bodies is not None:
+        return bodies
+
+    if 'chunk' in record:
+        chunks = [record['chunk']]
+    else:
+        keys = [chunk_key % (exchange, manifest['version'], i)
+                for i in xrange(manifest['chunks'])]
+        found = memcache.get_multi(keys)
+        chunks = [found.get(k) for k in keys]
+    stats = snappack.PackStats()
+    csvdata = snappack.unpack(manifest, chunks, stats)
+    if csvdata is None:
+        return None
+    logging.info('%s snapshot unpacked: %s' % (exchange, stats))
+    bodies = csvdata, snappack.to_gzip(''.join(chunks), csvdata)
+    snapshots.set(key, bodies, 0)
+    return bodies
+
+
+def _save_snapshot(exchange, record):
+    """Saves `record`, packing its CSV anew if it changed.  The chunks go
+    before the record, so the record never points at chunks that are not
+    there yet.  Returns False if memcache did not take the record."""
+    stored = dict(record)
+    csvdata = stored.pop('csv', None)
+    stored.pop('gzip', None)
+    manifest = stored.get('manifest')
+    if csvdata and (manifest is None or
+                    hashlib.md5(csvdata).hexdigest() != manifest['version']):
+        stats = snappack.PackStats()
+        manifest, chunks = snappack.pack(csvdata, stats=stats)
+        logging.info('%s snapshot packed: %s' % (exchange, stats))
+        stored['manifest'] = manifest
+        stored.pop('chunk', None)
+        if len(chunks) == 1 and len(chunks[0]) <= inline_chunk_size:
+            stored['chunk'] = chunks[0]
+        else:
+            failed = memcache.set_multi(dict(
+                (chunk_key % (exchange, manifest['version'], i), chunk)
+                for i, chunk in enumerate(chunks)))
+            if failed:
+                logging.error('Could not save %d chunks of the %s snapshot' %
+                              (len(failed), exchange))
+                del stored['manifest']
+    if not memcache.set(snapshot_key % exchange, stored):
+        logging.error('Could not save the %s snapshot record' % exchange)
+        return False
+    return True
+
+
+def _is_fresh(record):
+    """Tells if `seen` of `record` is still within its cache time."""
+    return (record.get('seen') is not None and
+            record.get('fresh_until', 0) > time.time())
+
+
+def _current(record):
+    """Returns the last update time the snapshot in `record` is known to be
+    up to date with: `saved`, or later if the exchange reported a new time
+    but its prices had not changed."""
+    return record.get('current') or record.get('saved')
+
+
+def _checked(record):
+    """Notes that the snapshot in `record` was just checked against the
+    exchange."""
+    record['checked'] = time.time()
+
+
+def _age(checked):
+    """Returns the seconds since a snapshot was `checked` against the
+    exchange, or None if that is not known."""
+    if checked is None:
+        return None
+    return max(0, time.time() - checked)
+
+
+def _http_date(when):
+    """Formats `when`, a time in Dhaka, as an HTTP date."""
+    return (when - tradingcal.DHAKA_OFFSET).strftime(
+        '%a, %d %b %Y %H:%M:%S GMT')
+
+
+def _etag(record, variant=None):
+    """Returns the strong ETag of the snapshot in `record`, from the update
+    time it is of and its md5.  `variant` tells apart what is made from the
+    same snapshot, like its gzip encoding or stats."""
+    etag = '%s-%s' % (record['saved'].strftime('%Y%m%d%H%M%S'),
+                      record['manifest']['version'])
+    if variant:
+        etag += '-' + variant
+    return '"%s"' % etag
+
+
+def _not_modified(headers, etag, last_update):
+    """Tells if a request with `headers` already has the snapshot with
+    `etag`, of `last_update`."""
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or 'W/' + etag in tags
+    since = headers.get('If-Modified-Since')
+    if since:
+        since = email.utils.parsedate(since.split(';')[0])
+        if since is not None:
+            return (datetime.datetime(*since[:6]) >=
+                    last_update.replace(microsecond=0) -
+                    tradingcal.DHAKA_OFFSET)
+    return False
+
+
+def _write_headers(response, record, fresh, etag):
+    """Says how old the snapshot in `record` is, how long it can be cached
+    and how to ask if it changed.  It is only marked stale when the
+    exchange reported an update it does not have yet."""
+    headers = response.headers
+    last_update = record['saved']
+    checked = record.get('checked')
+    age = _age(checked)
+    if age is not None:
+        headers['Age'] = str(int(age))
+    max_age = 0
+    if fresh and checked is not None:
+        # Caches count the Age against it.
+        max_age = max(0, int(record['fresh_until'] - checked))
+    headers['Cache-Control'] = 'public, max-age=%d' % max_age
+    headers['ETag'] = etag
+    headers['Last-Modified'] = _http_date(last_update)
+    headers['X-Last-Update'] = last_update.isoformat()
+    seen = record.get('seen')
+    if seen is not None and _current(record) < seen:
+        headers['Warning'] = '110 - "Response is Stale"'
+    headers['Vary'] = 'Accept-Encoding'
+
+
+def _write_csv(response, exchange, record, body, coding=None):
+    """Answers with `body`, the snapshot in `record` of `exchange` in the
+    content `coding`."""
+    _set_csv_header(response.headers, '%s-%s.csv' % (
+        exchange, record['saved'].isoformat()))
+    if coding:
+        response.headers['Content-Encoding'] = coding
+    response.out.write(body)
+
+
+def _start_fetch(record, url, conditional=False):
+    """Starts downloading `url`, sending the validators of its last download
+    kept in `record` if `conditional`.  Pass what it returns to
+    `_finish_fetch`."""
+    headers = {'Accept-Encoding': httpencoding.ACCEPT_ENCODING}
+    validators = conditional and record.get('validators', {}).get(url)
+    if validators:
+        etag, last_modified = validators
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+    rpc = urlfetch.create_rpc()
+    urlfetch.make_fetch_call(rpc, url, headers=headers)
+    return record, url, rpc
+
+
+def _finish_fetch(fetch):
+    """Waits for a download `_start_fetch` began.  Returns None if the page
+    has not changed since its last download."""
+    record, url, rpc = fetch
+    response = rpc.get_result()
+    if response.status_code == 304:
+        logging.info('%s not modified' % url)
+        return None
+    if response.status_code == 200:
+        record.setdefault('validators', {})[url] = (
+            response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        # urlfetch hands over the whole body at once, so it is decoded in
+        # one go.
+        response.content, decoder = httpencoding.decode(
+            response.content, response.headers.get('Content-Encoding'))
+        logging.info('%s: %s' % (url, decoder))
+    return response
+
+
+def _fetch(record, url, conditional=False):
+    """Fetches `url`, sending the validators of its last download if
+    `conditional`.  Returns None if the page has not changed since."""
+    return _finish_fetch(_start_fetch(record, url, conditional))
+
+
+def _page_unchanged(exchange, record, digest):
+    """Tells if the page with the md5 `digest` is byte for byte the page
+    `exchange` sent last time, and logs how often that happens."""
+    unchanged = record.get('page_hash') == digest
+
+    fetches = memcache.incr(page_fetches_key % exchange, initial_value=0)
+    if unchanged:
+        hits = memcache.incr(page_unchanged_key % exchange, initial_value=0)
+    else:
+        hits = memcache.get(page_unchanged_key % exchange) or 0
+    logging.info('%s page unchanged on %s of %s fetches' % (exchange, hits,
+                                                            fetches))
+    return unchanged
+
+
+def _restore_validators(record, url, validators):
+    """Puts back the `validators` `url` had before a download that could
+    not be used, so the next one is not answered with a 304 for it."""
+    if validators is None:
+        record.get('validators', {}).pop(url, None)
+    else:
+        record['validators'][url] = validators
+
+
+def _seen(exchange, record, last_update):
+    """Notes that `exchange` reported `last_update` and caches it: until the
+    next session while the markets are closed, about until the next update
+    is due while they are open."""
+    cadence = tradingcal.UpdateCadence(record.get('updates'),
+                                       default=cache_time)
+    cadence.observe(last_update)
+    wait = tradingcal.seconds_to_next_poll(calendar, [cadence])
+    logging.info('%s is not asked again for %d seconds' % (exchange, wait))
+    record['updates'] = cadence.updates
+    record['seen'] = last_update
+    record['fresh_until'] = time.time() + wait
+
+
+def _take_lease(exchange):
+    """Tells if this request gets to refresh `exchange`.  memcache.add
+    only succeeds for one of the requests racing for the lease, the others
+    are coalesced into its refresh."""
+    leased = memcache.add(lease_key % exchange, os.getpid(), lease_time)
+    if leased:
+        refreshes = memcache.incr(refreshes_key % exchange, initial_value=0)
+        coalesced = memcache.get(coalesced_key % exchange) or 0
+    else:
+        coalesced = memcache.incr(coalesced_key % exchange, initial_value=0)
+        refreshes = memcache.get(refreshes_key % exchange) or 0
+    logging.info('%s refreshed %s times, %s requests coalesced' % (
+        exchange, refreshes, coalesced))
+    return leased
+
+
+def _release_lease(exchange):
+    memcache.delete(lease_key % exchange)
+    memcache.delete(revalidate_key % exchange)
+
+
+def _queue_refresh(exchange):
+    """Queues a refresh of `exchange`, unless one is already queued or in
+    progress."""
+    if not memcache.add(revalidate_key % exchange, 1, lease_time):
+        return
+    try:
+        taskqueue.add(url='/refresh', params={'exchange': exchange},
+                      method='GET')
+    except taskqueue.Error, e:
+        # Cron comes around soon enough.
+        logging.warning('Could not queue a refresh of %s: %s' % (exchange, e))
+        memcache.delete(revalidate_key % exchange)
+
+
+def _wait_for_csv(exchange):
+    """Returns the snapshot record of `exchange` once it has a CSV, waiting
+    up to lease_wait seconds for it to turn up.  Returns None if it does
+    not."""
+    deadline = time.time() + lease_wait
+    while True:
+        record = _load_snapshot(exchange)
+        if record.get('csv') and record.get('saved') is not None:
+            return record
+        if time.time() >= deadline:
+            return None
+        time.sleep(lease_poll)
+
+
+def _saved_csv(record):
+    """Returns the CSV in `record`, or None if it has to be rebuilt because
+    it was saved without the stats that go with it."""
+    return record.get('stats') and record.get('csv') or None
+
+
+def _market_stats(table):
+    return json.dumps(quotes.market_stats(table, stats_top), sort_keys=True)
+
+
+def _get_dse_time(record):
+    if _is_fresh(record):
+        return record['seen']
+
+    previous = record.get('seen')
+    response = _fetch(record, dseroot, previous is not None)
+    if response is None:
+        _seen('dse', record, previous)
+        return previous
+    if response.status_code == 200:
+        last_update = stockparser.parse_dse_time(response.content)
+        if last_update is None:
+            logging.error('No last update time on %s' % dseroot)
+            return previous
+        logging.info("Last update on %s" % (last_update))
+        _seen('dse', record, last_update)
+        return last_update
+
+
+def refresh_dse(record):
+    """Brings the DSE snapshot `record` up to date, returns what it did."""
+    csvdata = _saved_csv(record)
+    last_saved = record.get('saved')
+    if (csvdata and last_saved is not None and _is_fresh(record) and
+        record['seen'] == _current(record)):
+        return 'fresh'
+
+    prices = None
+    if (dse_time_strategy == stockparser.TIME_CONCURRENT and
+        not _is_fresh(record)):
+        # The index page has to be downloaded for the time, download the
+        # prices along with it instead of after it.  Unless the time is
+        # new the download is dropped: the page may be newer than the
+        # snapshot, so neither its validators nor its hash are kept.
+        prices = _start_fetch(record, dselatest, bool(csvdata))
+
+    last_update = _get_dse_time(record)
+    if last_update is None:
+        return 'failed'
+
+    if _current(record) == last_update and csvdata:
+        # Not updated since the last snapshot.
+        _checked(record)
+        return 'not updated'
+
+    validators = record.get('validators', {}).get(dselatest)
+    if prices is not None:
+        dseresult = _finish_fetch(prices)
+    else:
+        dseresult = _fetch(record, dselatest, bool(csvdata))
+    if dseresult is None:
+        # The rows, and `saved` with them, stay as they were.
+        record['current'] = last_update
+        _checked(record)
+        return 'not modified'
+
+    if not dseresult.status_code == 200:
+        return 'failed'
+
+    digest = hashlib.md5(dseresult.content).hexdigest()
+    if _page_unchanged('dse', record, digest) and csvdata:
+        record['current'] = last_update
+        _checked(record)
+        return 'same page'
+
+    stats = stockparser.ParseStats()
+    heads, data = stockparser.parse_dse(dseresult.content, dse_parse_mode,
+                                        stats)
+    logging.info('DSE %s' % stats)
+    if not data:
+        # An error or maintenance page, the last snapshot stays.
+        logging.error('No prices on %s' % dselatest)
+        _restore_validators(record, dselatest, validators)
+        return 'failed'
+
+    table = quotes.DSE.snapshot(data, last_update)
+    del data
+    rows, inactive = quotes.to_rows(table, "%m-%d-%Y")
+    record['csv'] = stockparser.to_csv(rows, stockparser.stamp_heads(heads))
+    record['stats'] = _market_stats(table)
+    record['saved'] = record['current'] = last_update
+    record['page_hash'] = digest
+    _checked(record)
+    return 'fetched'
+
+
+def refresh_cse(record):
+    """Brings the CSE snapshot `record` up to date, returns what it did."""
+    csvdata = _saved_csv(record)
+    if _is_fresh(record) and csvdata:
+        return 'fresh'
+
+    last_saved = record.get('saved')
+    validators = record.get('validators', {}).get(cselatest)
+    cseresult = _fetch(record, cselatest, bool(csvdata and last_saved))
+    if cseresult is None:
+        _seen('cse', record, last_saved)
+        _checked(record)
+        return 'not modified'
+
+    if not cseresult.status_code == 200:
+        return 'failed'
+
+    digest = hashlib.md5(cseresult.content).hexdigest()
+    if (_page_unchanged('cse', record, digest) and csvdata and
+        last_saved is not None):
+        _seen('cse', record, last_saved)
+        _checked(record)
+        return 'same page'
+
+    stats = stockparser.ParseStats()
+    precontents = stockparser.parse_cse(cseresult.content, cse_parse_mode,
+                                        stats)
+    logging.info('CSE %s' % stats)
+
+    sdate = list(csedatere.search(precontents[0]).groups())
+    for i in [1, 3, 4]:
+        if len(sdate[i]) == 1:
+            sdate[i] = '0' + sdate[i]
+    sdate = ' '.join(sdate)
+    last_update = datetime.datetime.strptime(sdate, '%b %d %Y %I %M %p')
+
+    data, rejected = stockparser.parse_cse_rows(precontents[1])
+    logging.info('CSE report has %d rows, %d lines rejected' % (
+        len(data), rejected))
+    if not data:
+        logging.error('No prices on %s' % cselatest)
+        _restore_validators(record, cselatest, validators)
+        return 'failed'
+    table = quotes.CSE.snapshot(data, last_update)
+    del data
+    rows, inactive = quotes.to_rows(table, "%m-%d-%Y")
+    record['csv'] = stockparser.to_csv(rows, stockparser.CSE_HEADS)
+    record['stats'] = _market_stats(table)
+    record['saved'] = record['current'] = last_update
+    record['page_hash'] = digest
+    _seen('cse', record, last_update)
+    _checked(record)
+    return 'fetched'
+
+
+# exchange: function refreshing its snapshot record
+EXCHANGES = {
+    'dse': refresh_dse,
+    'cse': refresh_cse,
+}
+
+
+class RefreshHandler(webapp.RequestHandler):
+    """Downloads and parses the exchange pages into memcache, for cron and
+    the task queue.  Nothing else talks to the exchanges."""
 
-    dsesanere = re.compile(r'<body[^>]*>')
-    datere = re.compile(r'[a-zA-Z]{3}\s*\d{1,2},\s*\d{4}\s*at\s*\d{2}:\d{2}:\d{2}')
-
-    def _get_time(self):
-        last_update = memcache.get(dsedate_key)
-        if last_update is not None:
-            return last_update
+    def get(self):
+        exchange = self.request.get('exchange')
+        if exchange and exchange not in EXCHANGES:
+            self.error(404)
+            return
 
-        response = urlfetch.fetch(dseroot)
-        if response.status_code == 200:
-            last_update = self.datere.search(response.content).group()
-            last_update = last_update.replace(' ', '')
-            last_update = datetime.datetime.strptime(last_update, "%b%d,%Yat"
-                                                     "%H:%M:%S")
-            logging.info("Last update on %s" % (last_update))
-            memcache.set(dsedate_key, last_update, cache_time)
-            return last_update
+        self.response.headers['Content-Type'] = 'text/plain'
+        for name in exchange and [exchange] or sorted(EXCHANGES):
+            if not _take_lease(name):
+                self.response.out.write('%s: refresh in progress\n' % name)
+                continue
+            try:
+                record = _load_snapshot(name)
+                outcome = EXCHANGES[name](record)
+                if outcome != 'fresh':
+                    # Even a failed refresh may have learned validators.
+                    if not _save_snapshot(name, record):
+                        outcome = 'not saved'
+                    snapshots.delete(name)
+            finally:
+                _release_lease(name)
+            logging.info('%s refresh: %s' % (name, outcome))
+            self.response.out.write('%s: %s\n' % (name, outcome))
+
+
+def _has_snapshot(record):
+    return (record.get('manifest') is not None and
+            record.get('saved') is not None)
+
+
+def _read_snapshot(exchange):
+    """Returns the snapshot record of `exchange` without `csv` and `gzip`,
+    from this instance if it read it within snapshot_ttl seconds."""
+    record = snapshots.get(exchange)
+    if record is None:
+        record = _load_snapshot(exchange, False)
+        if _has_snapshot(record):
+            snapshots.set(exchange, record)
+        logging.info('snapshot cache: %s' % snapshots.stats())
+    return record
+
+
+class SnapshotHandler(webapp.RequestHandler):
+    """Answers with the snapshot of `exchange` and never asks the exchange
+    itself.  It takes one memcache call at most, none most of the time.
+
+    A snapshot past its cache time is served with no max-age, and marked
+    stale if the exchange has reported a newer update.  A refresh is
+    queued when there is no snapshot or cron has not refreshed it for
+    max_staleness.
+    """
+
+    exchange = None
 
     def get(self):
-        last_update = self._get_time()
-        csvname = 'dse-%s.csv' % last_update.isoformat()
-        _set_csv_header(self.response.headers, csvname)
-
-        last_saved = memcache.get(dse_last_saved_key)
-        if last_saved == last_update:
-            csvdata = memcache.get(dse_key)
-            if csvdata:
-                self.response.out.write(csvdata)
-                logging.info('returning from cache')
+        record = _read_snapshot(self.exchange)
+        if not _has_snapshot(record):
+            record = self._wait_for_snapshot()
+            if record is None:
                 return
 
-        dseresult = urlfetch.fetch(dselatest)
-        if not dseresult.status_code == 200:
-            self.response.out.write(fetch_error_message)
+        variant = self._variant()
+        if _not_modified(self.request.headers, _etag(record, variant),
+                         record['saved']):
+            self.response.set_status(304)
+            self._write_headers(record, variant)
             return
+        self._write_body(record, variant)
+
+    def _variant(self):
+        if httpencoding.accepts(self.request.headers.get('Accept-Encoding'),
+                                'gzip'):
+            return 'gzip'
+        return None
+
+    def _write_body(self, record, coding):
+        bodies = _load_csv(self.exchange, record)
+        if bodies is None:
+            snapshots.delete(self.exchange)
+            record = self._wait_for_snapshot()
+            if record is None:
+                return
+            bodies = record['csv'], record['gzip']
+        self._write_headers(record, coding)
+        _write_csv(self.response, self.exchange, record,
+                   bodies[coding == 'gzip'], coding)
+
+    def _wait_for_snapshot(self):
+        """Queues a refresh and returns the snapshot record it saves, or
+        answers 503 and returns None if it takes too long."""
+        _queue_refresh(self.exchange)
+        record = _wait_for_csv(self.exchange)
+        if record is None:
+            self.error(503)
+            self.response.headers['Retry-After'] = str(lease_time)
+            self.response.out.write(fetch_error_message)
+        return record
 
-        soup = BeautifulSoup(self.dsesanere.sub('<body>', dseresult.content))
-        headtr = soup.body.table.tr.findAll('b')
-
-        output = StringIO.StringIO()
-        csvfile = csv.writer(output)
-        heads = []
-        for h in headtr:
-            heads.append(str(h.contents[0]).replace('&nbsp;', '').strip())
-
-        heads.insert(1, "Date")
-        heads.insert(2, "Time")
-        csvfile.writerow(heads)
-
-        data = soup.body.table.findAll('tr')[1:]
-        for row in data:
-            row = row.findAll('td')[1:]
-
-            d = [row[0].a.contents[0], last_update.strftime("%m-%d-%Y"),
-                 last_update.strftime("%H:%M:%S")]
-            for col in row[1:]:
-                d.append(col.find(text=True))
-
-            if d[-1] != '0':
-                csvfile.writerow(d)
+    def _write_headers(self, record, variant):
+        fresh = _is_fresh(record) and record['seen'] == _current(record)
+        if not fresh:
+            age = _age(record.get('checked'))
+            if age is None or age > max_staleness:
+                _queue_refresh(self.exchange)
+        _write_headers(self.response, record, fresh, _etag(record, variant))
 
-        csvdata = output.getvalue()
-        output.close()
 
-        self.response.out.write(csvdata)
+class DSEHandler(SnapshotHandler):
+    exchange = 'dse'
 
-        memcache.set(dse_key, csvdata)
-        memcache.set(dse_last_saved_key, last_update)
-        logging.info('fetched real data')
 
+class CSEHandler(SnapshotHandler):
+    exchange = 'cse'
 
-class CSEHandler(webapp.RequestHandler):
 
-    csedatere = re.compile(r'Date: '
-                           r'([a-zA-Z]{3})\s*(\d{1,2})\s*(\d{4})\s*(\d{1,2}):(\d{1,2})(AM|PM)')
-    csedatare = re.compile(r'^\s*(\w+).*?'
-                           '(\d+\.{0,1}\d*)\s+'
-                           '(\d+\.{0,1}\d*)\s+'
-                           '(\d+\.{0,1}\d*)\s+'
-                           '(\d+\.{0,1}\d*)\s+'
-                           '(\d+\.{0,1}\d*)\s+'
-                           '(-{0,1}\d+\.{0,1}\d*)\s+'
-                           '(\d+\.{0,1}\d*)\s+'
-                           '(\d+\.{0,1}\d*)\s+', re.MULTILINE)
+class StatsHandler(SnapshotHandler):
+    """Answers with the market summary of the snapshot of `exchange` as
+    JSON: top gainers, losers, turnover and volume, advances, declines and
+    totals.  It is worked out once, when the snapshot is saved."""
 
-    def get(self):
-        last_update = memcache.get(csedate_key)
-        csvdata = memcache.get(cse_key)
-        if csvdata and last_update is not None:
-            csvname = 'cse-%s.csv' % last_update.isoformat()
-            _set_csv_header(self.response.headers, csvname)
-            self.response.out.write(csvdata)
-
-            logging.info('retrieved from cache')
-            return
+    def _variant(self):
+        return 'stats'
 
-        cseresult = urlfetch.fetch(cselatest)
-        if not cseresult.status_code == 200:
+    def _write_body(self, record, variant):
+        if not record.get('stats'):
+            # Saved before stats were kept, the next refresh adds them.
+            _queue_refresh(self.exchange)
+            self.error(503)
+            self.response.headers['Retry-After'] = str(lease_time)
             self.response.out.write(fetch_error_message)
             return
+        self._write_headers(record, variant)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(record['stats'])
 
-        soup = BeautifulSoup(cseresult.content)
-        precontents = soup.body.findAll('pre')
-
-        sdate = list(self.csedatere.search(precontents[0].contents[0]).groups())
-        for i in [1, 3, 4]:
-            if len(sdate[i]) == 1:
-                sdate[i] = '0' + sdate[i]
-        sdate = ' '.join(sdate)
-        last_update = datetime.datetime.strptime(sdate,
-                                                 '%b %d %Y %I %M %p')
-        csvname = 'cse-%s.csv' % last_update.isoformat()
-
-        output = StringIO.StringIO()
-        csvfile = csv.writer(output)
-        heads = ['Company', 'Date', 'Time', 'Open', 'High', 'Low', 'Close',
-                 'Prev. Close', 'Difference', 'Trades', 'Volume',]
-        csvfile.writerow(heads)
-
-        contents = precontents[1].contents[0].split('\n')
-        for content in contents:
-            try:
-                data = list(self.csedatare.search(content).groups())
-                if data[-1] == '0':
-                    continue
-                data.insert(1, last_update.strftime("%m-%d-%Y"))
-                data.insert(2, last_update.strftime("%H:%M:%S"))
-                csvfile.writerow(data)
-            except:
-                pass
 
-        csvdata = output.getvalue()
-        output.close()
+class DSEStatsHandler(StatsHandler):
+    exchange = 'dse'
 
-        _set_csv_header(self.response.headers, csvname)
-        self.response.out.write(csvdata)
 
-        memcache.set(cse_key, csvdata, cache_time)
-        memcache.set(csedate_key, last_update, cache_time)
-        logging.info('fetched real data')
+class CSEStatsHandler(StatsHandler):
+    exchange = 'cse'
 
 
 class MainHandler(webapp.RequestHandler):
@@ -198,7 +748,10 @@ class MainHandler(webapp.RequestHandler):
 def main():
   application = webapp.WSGIApplication([('/', MainHandler),
                                         ('/dse', DSEHandler),
-                                        ('/cse', CSEHandler)],
+                                        ('/cse', CSEHandler),
+                                        ('/dse/stats', DSEStatsHandler),
+                                        ('/cse/stats', CSEStatsHandler),
+                                        ('/refresh', RefreshHandler)],
                                        debug=True)
   util.run_wsgi_app(application)
 
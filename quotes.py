@@ -0,0 +1,381 @@
+#!/usr/bin/env python
+
+"""Quotes of the DSE and CSE snapshots, held column by column.
+
+The columns are numpy arrays when numpy is there and `array` ones
+otherwise.  The CSV keeps the text of the page, the numbers are for
+filtering, the stats, the history and the bars.
+"""
+
+__author__ = "M Nasimul Haque (nasim.haque@gmail.com)"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2010 M Nasimul Haque"
+__license__ = "New-style BSD"
+
+import array
+import operator
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Quote(object):
+    """Prices of one company at one update of an exchange, a row of a
+    `Snapshot`.
+
+    Prices are floats, `trades` and `volume` ints.  Fields an exchange does
+    not publish, and values it printed as something other than a number,
+    are None.
+    """
+
+    __slots__ = ('symbol', 'last_update', 'open', 'ltp', 'high', 'low',
+                 'close', 'ycp', 'change', 'trades', 'value', 'volume')
+
+    def __init__(self, symbol, last_update, open=None, ltp=None, high=None,
+                 low=None, close=None, ycp=None, change=None, trades=None,
+                 value=None, volume=None):
+        self.symbol = symbol
+        self.last_update = last_update
+        self.open = open
+        self.ltp = ltp
+        self.high = high
+        self.low = low
+        self.close = close
+        self.ycp = ycp
+        self.change = change
+        self.trades = trades
+        self.value = value
+        self.volume = volume
+
+    def __repr__(self):
+        return '<Quote %s at %s>' % (self.symbol, self.last_update)
+
+
+# Counts are ints, everything else floats.  Values that are not known are
+# NaN in a float column and MISSING_COUNT in an int one.
+_COUNTS = ('trades', 'volume')
+MISSING_COUNT = -1
+_NAN = float('nan')
+
+
+def _number(text, field):
+    if text is None:
+        return None
+    text = text.strip().replace(',', '')
+    try:
+        if field in _COUNTS:
+            return int(text)
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _column(field, values):
+    if field in _COUNTS:
+        values = [value is None and MISSING_COUNT or value
+                  for value in values]
+        if numpy is not None:
+            return numpy.array(values, dtype=numpy.int64)
+        return array.array('l', values)
+    values = [value is None and _NAN or value for value in values]
+    if numpy is not None:
+        return numpy.array(values, dtype=numpy.float64)
+    return array.array('d', values)
+
+
+def _text(cell):
+    if isinstance(cell, unicode):
+        return cell.encode('utf-8')
+    return cell
+
+
+def _value(field, value):
+    """Returns `value` of a column as a Python number, None if it is not
+    known."""
+    if field in _COUNTS:
+        value = int(value)
+        if value == MISSING_COUNT:
+            return None
+        return value
+    value = float(value)
+    if value != value:
+        return None
+    return value
+
+
+class Layout(object):
+    """The price columns of an exchange page: the Quote field each one goes
+    into and how the exchange prints it, for writing out numbers there is
+    no page text of.
+
+    `formats` has a % format for every field, None for str().  `price` is
+    the field quoted as the price of a company.
+    """
+
+    def __init__(self, fields, formats, price='close'):
+        self.fields = fields
+        self.formats = formats
+        self.price = price
+
+    def snapshot(self, rows, last_update):
+        """Returns the Snapshot of `[symbol, value, ...]` text rows."""
+        symbols = []
+        columns = [[] for field in self.fields]
+        texts = []
+        for row in rows:
+            symbols.append(str(_text(row[0])).strip())
+            texts.append([_text(cell) for cell in row[1:]])
+            for field, column, text in map(None, self.fields, columns,
+                                           row[1:len(self.fields) + 1]):
+                column.append(_number(text, field))
+        return Snapshot(self, last_update, symbols,
+                        dict((field, _column(field, column))
+                             for field, column in zip(self.fields, columns)),
+                        texts)
+
+    def format(self, field, value):
+        """Returns `value` of `field` printed the way the exchange prints
+        it, with more decimals if that would round it."""
+        if value is None:
+            return ''
+        format = self.formats[list(self.fields).index(field)]
+        if format is not None:
+            text = format % value
+            if float(text) == value:
+                return text
+        return str(value)
+
+    def values(self, snapshot, i):
+        """Returns the price columns of row `i` of `snapshot`, as the page
+        had them if it came from one."""
+        if snapshot.texts is not None:
+            return list(snapshot.texts[i])
+        return [self.format(field, _value(field, snapshot.columns[field][i]))
+                for field in self.fields]
+
+
+DSE = Layout(('ltp', 'high', 'low', 'close', 'ycp', 'change', 'trades',
+              'value', 'volume'),
+             ('%.1f', '%.1f', '%.1f', '%.1f', '%.1f', '%.1f', '%d', None,
+              '%d'),
+             price='ltp')
+
+CSE = Layout(('open', 'high', 'low', 'close', 'ycp', 'change', 'trades',
+              'volume'),
+             ('%.2f', '%.2f', '%.2f', '%.2f', '%.2f', '%.2f', '%d', '%d'))
+
+
+_OPERATORS = {'<': operator.lt, '<=': operator.le, '==': operator.eq,
+              '!=': operator.ne, '>=': operator.ge, '>': operator.gt}
+
+
+class Snapshot(object):
+    """Quotes of one update of an exchange held column by column.
+
+    `symbols` is a list, `columns` maps every field of `layout` to an
+    array of its values, one per symbol.  `texts` has the price cells of
+    every symbol as the page had them, None if the snapshot did not come
+    from a page.  Filtering and sorting return new snapshots and work on
+    whole columns at a time.
+    """
+
+    def __init__(self, layout, last_update, symbols, columns, texts=None):
+        self.layout = layout
+        self.last_update = last_update
+        self.symbols = symbols
+        self.columns = columns
+        self.texts = texts
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def quote(self, i):
+        """Returns row `i` as a Quote."""
+        quote = Quote(self.symbols[i], self.last_update)
+        for field in self.layout.fields:
+            setattr(quote, field, _value(field, self.columns[field][i]))
+        return quote
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self.quote(i)
+
+    def mask(self, field, op, value):
+        """Returns which rows have `field` `op` `value`, op being one of <,
+        <=, ==, !=, >= and >.  Combine masks with `&` and `|` under numpy,
+        pass them to `take`."""
+        compare = _OPERATORS[op]
+        column = self.columns[field]
+        if numpy is not None:
+            return compare(column, value)
+        return [compare(v, value) for v in column]
+
+    def take(self, rows):
+        """Returns a snapshot of `rows`, a mask or a sequence of row
+        numbers, in their order."""
+        if numpy is not None:
+            rows = numpy.asarray(rows)
+            if rows.dtype == bool:
+                rows = numpy.flatnonzero(rows)
+            else:
+                rows = rows.astype(numpy.intp)
+            columns = dict((field, column[rows])
+                           for field, column in self.columns.items())
+        else:
+            if rows and isinstance(rows[0], bool):
+                rows = [i for i, keep in enumerate(rows) if keep]
+            columns = dict((field, array.array(column.typecode,
+                                               [column[i] for i in rows]))
+                           for field, column in self.columns.items())
+        texts = None
+        if self.texts is not None:
+            texts = [self.texts[i] for i in rows]
+        return Snapshot(self.layout, self.last_update,
+                        [self.symbols[i] for i in rows], columns, texts)
+
+    def where(self, field, op, value):
+        return self.take(self.mask(field, op, value))
+
+    def active(self):
+        """Returns the snapshot of the companies that traded at all."""
+        return self.where('volume', '!=', 0)
+
+    def inactive(self):
+        return len(self) - len(self.active())
+
+    def order(self, field, reverse=False):
+        """Returns the row numbers sorted by `field`, ties kept in the order
+        they are in."""
+        column = self.columns[field]
+        if numpy is not None:
+            if reverse:
+                return numpy.argsort(-column, kind='mergesort')
+            return numpy.argsort(column, kind='mergesort')
+        return sorted(xrange(len(self)), key=column.__getitem__,
+                      reverse=reverse)
+
+    def sort(self, field, reverse=False):
+        """Returns the snapshot sorted by `field`."""
+        return self.take(self.order(field, reverse))
+
+    def known(self, field):
+        """Returns the snapshot of the companies `field` is known of."""
+        if field in _COUNTS:
+            return self.where(field, '!=', MISSING_COUNT)
+        # NaN is neither bigger nor smaller than anything.
+        return self.where(field, '>', float('-inf'))
+
+    def with_columns(self, **columns):
+        """Returns the snapshot with more `columns`, derived ones that
+        filtering and sorting carry along."""
+        all_columns = dict(self.columns)
+        all_columns.update(columns)
+        return Snapshot(self.layout, self.last_update, self.symbols,
+                        all_columns, self.texts)
+
+    def percent_change(self):
+        """Returns a column of the change of every company as a percentage
+        of its previous close, NaN where that is not known."""
+        change, ycp = self.columns['change'], self.columns['ycp']
+        if numpy is not None:
+            errors = numpy.seterr(divide='ignore', invalid='ignore')
+            try:
+                return numpy.where(ycp > 0, change / ycp * 100, numpy.nan)
+            finally:
+                numpy.seterr(**errors)
+        return array.array('d', [c / y * 100 if y > 0 else _NAN
+                                 for c, y in zip(change, ycp)])
+
+    def turnover(self):
+        """Returns a column of the value traded of every company in
+        millions, worked out from the price and volume on exchanges that do
+        not publish it."""
+        if 'value' in self.columns:
+            return self.columns['value']
+        price, volume = self.columns[self.layout.price], self.columns['volume']
+        if numpy is not None:
+            return numpy.where(volume >= 0, price * volume / 1e6, numpy.nan)
+        return array.array('d', [p * v / 1e6 if v >= 0 else _NAN
+                                 for p, v in zip(price, volume)])
+
+    def total(self, field):
+        """Returns the sum of the known values of `field`."""
+        column = self.known(field).columns[field]
+        if numpy is not None:
+            return _value(field, column.sum())
+        return _value(field, sum(column))
+
+
+def to_rows(snapshot, date_format, prune=True):
+    """Returns `(rows, inactive)`.
+
+    `rows` are `[symbol, date, time, price columns...]` text lists, leaving
+    out the companies without any volume when `prune` is on.  `inactive`
+    is the number of companies without any volume.
+    """
+    active = snapshot.active()
+    inactive = len(snapshot) - len(active)
+    if prune:
+        snapshot = active
+    date = snapshot.last_update.strftime(date_format)
+    hms = snapshot.last_update.strftime("%H:%M:%S")
+    values = snapshot.layout.values
+    rows = [[symbol, date, hms] + values(snapshot, i)
+            for i, symbol in enumerate(snapshot.symbols)]
+    return rows, inactive
+
+
+def _round(value, digits):
+    if value is None:
+        return None
+    return round(value, digits)
+
+
+def _summary(snapshot, i):
+    quote = snapshot.quote(i)
+    return {'symbol': quote.symbol,
+            'price': getattr(quote, snapshot.layout.price),
+            'change': quote.change,
+            'percent_change': _round(_value(
+                'percent_change', snapshot.columns['percent_change'][i]), 2),
+            'volume': quote.volume,
+            'trades': quote.trades,
+            'turnover': _round(_value(
+                'turnover', snapshot.columns['turnover'][i]), 3)}
+
+
+def _top(snapshot, field, n, reverse=True):
+    snapshot = snapshot.known(field)
+    return [_summary(snapshot, i)
+            for i in snapshot.order(field, reverse)[:n]]
+
+
+def market_stats(snapshot, top=10):
+    """Returns the summary of the market in `snapshot` as a dict of plain
+    values: the `top` gainers and losers by percent change and companies by
+    turnover and volume, the number of advances, declines and unchanged
+    prices and the totals traded.  Only companies that traded count.
+    Turnover is in millions, rounded to thousands like the DSE prints it,
+    percent changes to two decimals."""
+    traded = snapshot.active()
+    traded = traded.with_columns(percent_change=traded.percent_change(),
+                                 turnover=traded.turnover())
+    return {
+        'last_update': snapshot.last_update.isoformat(),
+        'companies': len(snapshot),
+        'traded': len(traded),
+        'advances': len(traded.where('change', '>', 0)),
+        'declines': len(traded.where('change', '<', 0)),
+        'unchanged': len(traded.where('change', '==', 0)),
+        'turnover': _round(traded.total('turnover'), 3),
+        'volume': traded.total('volume'),
+        'trades': traded.total('trades'),
+        'gainers': _top(traded.where('percent_change', '>', 0),
+                        'percent_change', top),
+        'losers': _top(traded.where('percent_change', '<', 0),
+                       'percent_change', top, False),
+        'top_turnover': _top(traded, 'turnover', top),
+        'top_volume': _top(traded, 'volume', top),
+    }
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""A small in-process cache for the App Engine handlers in main.py.
+
+An instance lives as long as its interpreter, so what main.py keeps here is
+served without any memcache round trip until it expires.
+"""
+
+__author__ = "M Nasimul Haque (nasim.haque@gmail.com)"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2010 M Nasimul Haque"
+__license__ = "New-style BSD"
+
+import time
+
+
+class LRUCache(object):
+    """Holds up to `maxsize` values, dropping the least recently used one to
+    make room.
+
+    Values expire `ttl` seconds after they are set unless `set` is given a
+    `ttl` of its own, 0 for never.  `hits` and `misses` count the lookups.
+    """
+
+    def __init__(self, maxsize=16, ttl=5):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._tick = 0
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] and entry[1] <= time.time():
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._tick += 1
+        entry[2] = self._tick
+        return entry[0]
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        if key not in self._entries and len(self._entries) >= self.maxsize:
+            self._evict()
+        self._tick += 1
+        self._entries[key] = [value, ttl and time.time() + ttl, self._tick]
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def _evict(self):
+        # Linear, but the cache only ever holds a handful of snapshots.
+        oldest = min(self._entries.items(), key=lambda item: item[1][2])
+        del self._entries[oldest[0]]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return '%d hits, %d misses (%.0f%% hit rate), %d entries' % (
+            self.hits, self.misses,
+            lookups and 100.0 * self.hits / lookups or 0, len(self))
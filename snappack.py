@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""Packs snapshots into memcache sized pieces for main.py.
+
+A snapshot is compressed with zlib and cut into chunks no bigger than
+memcache takes.  The manifest `pack` returns says what the chunks must add
+up to; `unpack` only returns a snapshot that does, so chunks that were
+evicted or belong to another version are never served.  `to_gzip` turns the
+packed snapshot into a gzip encoded response body without compressing it
+again.
+"""
+
+__author__ = "M Nasimul Haque (nasim.haque@gmail.com)"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2010 M Nasimul Haque"
+__license__ = "New-style BSD"
+
+import hashlib
+import struct
+import time
+import zlib
+
+
+# memcache takes values up to 1MB, keys and flags included.
+CHUNK_SIZE = 1000 * 1000 - 4096
+
+LEVEL = 6
+
+
+class PackStats(object):
+    """What packing or unpacking a snapshot cost: its size before and after
+    compression, the number of chunks and the time it took."""
+
+    def __init__(self):
+        self.size = 0
+        self.packed_size = 0
+        self.chunks = 0
+        self.elapsed = 0.0
+
+    def ratio(self):
+        """Packed size as a share of the snapshot size."""
+        if not self.size:
+            return 1.0
+        return float(self.packed_size) / self.size
+
+    def __str__(self):
+        return '%d bytes in %d bytes (%.0f%% saved), %d chunks, %.1fms' % (
+            self.size, self.packed_size, (1 - self.ratio()) * 100,
+            self.chunks, self.elapsed * 1000)
+
+
+def pack(data, chunk_size=CHUNK_SIZE, level=LEVEL, stats=None):
+    """Returns `(manifest, chunks)` for `data`.
+
+    The manifest is a dict with the md5 of `data` as its `version`, its
+    `size`, the `packed_size` after compression and the number of
+    `chunks`.
+    """
+    start = time.time()
+    packed = zlib.compress(data, level)
+    chunks = [packed[i:i + chunk_size]
+              for i in xrange(0, len(packed), chunk_size)] or ['']
+    manifest = {'version': hashlib.md5(data).hexdigest(),
+                'size': len(data),
+                'packed_size': len(packed),
+                'chunks': len(chunks)}
+    if stats is not None:
+        stats.size = len(data)
+        stats.packed_size = len(packed)
+        stats.chunks = len(chunks)
+        stats.elapsed = time.time() - start
+    return manifest, chunks
+
+
+def unpack(manifest, chunks, stats=None):
+    """Returns the data `chunks` were packed from, or None if some are
+    missing or they do not add up to the version in `manifest`."""
+    start = time.time()
+    if len(chunks) != manifest['chunks'] or None in chunks:
+        return None
+    try:
+        data = zlib.decompress(''.join(chunks))
+    except zlib.error:
+        return None
+    if (len(data) != manifest['size'] or
+        hashlib.md5(data).hexdigest() != manifest['version']):
+        return None
+    if stats is not None:
+        stats.size = len(data)
+        stats.packed_size = manifest['packed_size']
+        stats.chunks = len(chunks)
+        stats.elapsed = time.time() - start
+    return data
+
+
+def to_gzip(packed, data):
+    """Returns `data` gzip encoded, given it `packed` with zlib.
+
+    Both wrap the same deflate stream, so only the zlib header and trailer
+    are swapped for gzip ones.
+    """
+    return ('\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff' + packed[2:-4] +
+            struct.pack('<II', zlib.crc32(data) & 0xffffffff,
+                        len(data) & 0xffffffff))
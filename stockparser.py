@@ -0,0 +1,478 @@
+#!/usr/bin/env python
+
+"""Parsers for the DSE and CSE price pages."""
+
+__author__ = "M Nasimul Haque (nasim.haque@gmail.com)"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2010 M Nasimul Haque"
+__license__ = "New-style BSD"
+
+import csv
+import datetime
+import re
+import time
+import cStringIO as StringIO
+from sgmllib import SGMLParser, SGMLParseError
+
+from BeautifulSoup import BeautifulSoup, BeautifulStoneSoup, SoupStrainer
+
+
+# Parse modes, from the cheapest to the most forgiving one.
+PARSE_STREAM = 'stream'
+PARSE_REGEX = 'regex'
+PARSE_STRAINED = 'strained'
+PARSE_FULL = 'full'
+
+
+# Ways of finding out when the DSE prices were last updated.  Only the
+# index page carries the time, the price page does not.
+TIME_INDEX = 'index'            # download the index page, then the prices
+TIME_PARTIAL = 'partial'        # read the index page only up to the time
+TIME_CONCURRENT = 'concurrent'  # download both pages at the same time
+
+
+CSE_HEADS = ['Company', 'Date', 'Time', 'Open', 'High', 'Low', 'Close',
+             'Prev. Close', 'Difference', 'Trades', 'Volume',]
+
+
+_RE_DSE_TIME = re.compile(r'[a-zA-Z]{3}\s*\d{1,2},\s*\d{4}\s*at\s*\d{2}:\d{2}:\d{2}')
+_RE_HTML_BODY_SANITIZER = re.compile(r'<body[^>]*>')
+# Text of a <pre> up to its first tag, which is what BeautifulSoup gives
+# as the first child of the <pre>.
+_RE_PRE_TEXT = re.compile(r'<pre(?:\s[^>]*)?>([^<]*)', re.IGNORECASE)
+# One CSE report line: company code, open, high, low, close, previous
+# close, difference, trades and volume.  Whitespace is kept from matching
+# newlines so a match never spans two report lines.
+_RE_CSE_ROW = re.compile(r'^[^\S\n]*(\w+)[^\n]*?'
+                         r'(\d+\.{0,1}\d*)[^\S\n]+'
+                         r'(\d+\.{0,1}\d*)[^\S\n]+'
+                         r'(\d+\.{0,1}\d*)[^\S\n]+'
+                         r'(\d+\.{0,1}\d*)[^\S\n]+'
+                         r'(\d+\.{0,1}\d*)[^\S\n]+'
+                         r'(-{0,1}\d+\.{0,1}\d*)[^\S\n]+'
+                         r'(\d+\.{0,1}\d*)[^\S\n]+'
+                         r'(\d+\.{0,1}\d*)[^\S\n]+', re.MULTILINE)
+_RE_NON_BLANK_LINE = re.compile(r'^[^\S\n]*\S', re.MULTILINE)
+
+
+def sanitize_dse_html(markup):
+    """DSE sends a <body> tag sgmllib cannot digest, replace it."""
+    return _RE_HTML_BODY_SANITIZER.sub('<body>', markup)
+
+
+def clean_header(text):
+    return str(text).replace('&nbsp;', '').strip()
+
+
+class DSETableExtractor(SGMLParser):
+    """Event driven extractor for the DSE latest share price table.
+
+    Rows are collected straight from the sgmllib tokenizer, no parse tree
+    is built.  Only the first <table> of the page is looked at and the
+    extractor marks itself `done` as soon as that table is closed, so the
+    caller can stop feeding the rest of the page.
+
+    The values produced are the same as the ones the BeautifulSoup version
+    used to pick: the text of every <b> in the header row, the first text
+    of the <a> in the trading code cell and the first text node of every
+    other cell.
+    """
+
+    QUOTE_TAGS = ('script', 'textarea')
+
+    def reset(self):
+        SGMLParser.reset(self)
+        self.heads = []
+        self.rows = []
+        self.done = False
+        self._depth = 0
+        self._seen_header = False
+        self._in_header = False
+        self._cells = None
+        self._cell = None
+        self._b_open = False
+        self._a_open = False
+        self._quote = None
+        self._text = []
+
+    # Text nodes end at every markup boundary, the same way BeautifulSoup
+    # splits its NavigableStrings.
+    def _end_text(self):
+        if not self._text:
+            return None
+        text = ''.join(self._text)
+        self._text = []
+        if not text.strip(' \t\n\r\f'):
+            if '\n' in text:
+                text = '\n'
+            else:
+                text = ' '
+        return text
+
+    def _first_child(self, text):
+        """`text` is None when the first child is a tag."""
+        if self._b_open:
+            if text is not None:
+                self.heads.append(clean_header(text))
+            self._b_open = False
+        if self._a_open:
+            self._cell[1] = text
+            self._a_open = False
+        if text is not None and self._cell is not None \
+           and self._cell[0] is None:
+            self._cell[0] = text
+
+    def _flush(self):
+        text = self._end_text()
+        if text is not None:
+            self._first_child(text)
+
+    def _end_row(self):
+        self._end_cell()
+        cells, self._cells = self._cells, None
+        if cells is None or self._in_header:
+            self._in_header = False
+            return
+        cells = cells[1:]
+        if not cells or cells[0][1] is None:
+            return
+        row = [cells[0][1]]
+        for cell in cells[1:]:
+            row.append(cell[0])
+        self.rows.append(row)
+
+    def _end_cell(self):
+        if self._cell is not None:
+            self._cells.append(self._cell)
+            self._cell = None
+        self._a_open = self._b_open = False
+
+    def unknown_starttag(self, tag, attrs):
+        if self._quote is not None:
+            self.handle_data(self.get_starttag_text())
+            return
+        self._flush()
+        if self._b_open or self._a_open:
+            self._first_child(None)
+        if tag in self.QUOTE_TAGS:
+            self._quote = tag
+            self.setliteral()
+            return
+        if self.done:
+            return
+
+        if tag == 'table':
+            self._depth += 1
+        elif not self._depth:
+            return
+        elif tag == 'tr':
+            self._end_row()
+            self._cells = []
+            if not self._seen_header:
+                self._seen_header = self._in_header = True
+        elif tag == 'td' and self._cells is not None:
+            self._end_cell()
+            self._cell = [None, None]
+        elif tag == 'b' and self._in_header:
+            self._b_open = True
+        elif tag == 'a' and self._cell is not None and self._cell[1] is None:
+            self._a_open = True
+
+    def unknown_endtag(self, tag):
+        if self._quote is not None:
+            if tag != self._quote:
+                self.handle_data('</%s>' % tag)
+                self.setliteral()
+                return
+            self._quote = None
+        self._flush()
+        self._b_open = self._a_open = False
+        if self.done or not self._depth:
+            return
+
+        if tag == 'td':
+            self._end_cell()
+        elif tag == 'tr':
+            self._end_row()
+        elif tag == 'table':
+            self._depth -= 1
+            if not self._depth:
+                self._end_row()
+                self.done = True
+
+    def handle_data(self, data):
+        self._text.append(data)
+
+    def handle_charref(self, ref):
+        self.handle_data('&#%s;' % ref)
+
+    def handle_entityref(self, ref):
+        self.handle_data('&%s;' % ref)
+
+    def handle_comment(self, text):
+        self._flush()
+
+    def handle_decl(self, data):
+        self._flush()
+
+    def parse_declaration(self, i):
+        try:
+            return SGMLParser.parse_declaration(self, i)
+        except SGMLParseError:
+            self.handle_data(self.rawdata[i:])
+            return len(self.rawdata)
+
+    def close(self):
+        SGMLParser.close(self)
+        self._flush()
+        if not self.done:
+            self._end_row()
+
+
+def _massage(markup):
+    for fix, m in BeautifulStoneSoup.MARKUP_MASSAGE:
+        markup = fix.sub(m, markup)
+    return markup
+
+
+def iter_dse_rows(markup, extractor=None, chunk_size=16 * 1024):
+    """Yields DSE price rows as `[code, ltp, high, ..., volume]` lists.
+
+    The page is fed to the tokenizer in chunks and parsing stops as soon as
+    the price table is closed.  Pass your own `extractor` to get hold of the
+    header cells afterwards.
+    """
+    if extractor is None:
+        extractor = DSETableExtractor()
+    markup = _massage(sanitize_dse_html(markup))
+
+    for start in xrange(0, len(markup), chunk_size):
+        extractor.feed(markup[start:start + chunk_size])
+        rows, extractor.rows = extractor.rows, []
+        for row in rows:
+            yield row
+        if extractor.done:
+            return
+
+    extractor.close()
+    for row in extractor.rows:
+        yield row
+    extractor.rows = []
+
+
+def parse_dse_stream(markup):
+    """Returns `(heads, rows)` of the DSE price table without a parse tree."""
+    extractor = DSETableExtractor()
+    rows = list(iter_dse_rows(markup, extractor))
+    return extractor.heads, rows
+
+
+class ParseStats(object):
+    """What a parse cost: the mode that produced the result, the time it
+    took, modes that came back empty and were fallen back from included,
+    and the size of the parse tree built for it.
+
+    The tree size is its number of nodes and `tree_bytes`, what they hold:
+    the text of the page and the names and attributes of its tags.  It is
+    what the tree keeps alive on top of the page itself; the peak memory of
+    every mode is measured by bench/parsebench.py.
+    """
+
+    def __init__(self):
+        self.mode = None
+        self.elapsed = 0.0
+        self.nodes = 0
+        self.tree_bytes = 0
+        self.fallbacks = []
+
+    def __str__(self):
+        s = '%s parse in %.1fms' % (self.mode, self.elapsed * 1000)
+        if self.nodes:
+            s += ', tree of %d nodes holding %.1fKB' % (
+                self.nodes, self.tree_bytes / 1024.0)
+        if self.fallbacks:
+            s += ' (fell back from %s)' % ', '.join(self.fallbacks)
+        return s
+
+    def measure(self, soup):
+        """Takes the tree size from `soup`, None if no tree was built."""
+        self.nodes = self.tree_bytes = 0
+        if soup is None:
+            return
+        for node in soup.recursiveChildGenerator():
+            self.nodes += 1
+            if isinstance(node, basestring):
+                self.tree_bytes += len(node)
+            else:
+                self.tree_bytes += len(node.name)
+                for name, value in node.attrs:
+                    self.tree_bytes += len(name) + len(value or '')
+
+    def saving_over(self, other):
+        """Describes how much cheaper this parse was than `other`."""
+        return 'saved %.1fms, %d nodes and %.1fKB of tree over %s parse' % (
+            (other.elapsed - self.elapsed) * 1000, other.nodes - self.nodes,
+            (other.tree_bytes - self.tree_bytes) / 1024.0, other.mode)
+
+
+def _rows_from_table(table):
+    heads = []
+    for h in table.tr.findAll('b'):
+        heads.append(clean_header(h.contents[0]))
+
+    rows = []
+    for tr in table.findAll('tr')[1:]:
+        tds = tr.findAll('td')[1:]
+        if not tds or tds[0].a is None:
+            continue
+        row = [tds[0].a.contents[0]]
+        for col in tds[1:]:
+            row.append(col.find(text=True))
+        rows.append(row)
+    return heads, rows
+
+
+def parse_dse_tree(markup, strained=True):
+    """Returns `(heads, rows, soup)` of the DSE price table.
+
+    With `strained` only the <table> elements of the page are built into
+    the parse tree, otherwise the whole page is.
+    """
+    markup = sanitize_dse_html(markup)
+    if strained:
+        soup = BeautifulSoup(markup, parseOnlyThese=SoupStrainer('table'))
+        table = soup.find('table')
+    else:
+        soup = BeautifulSoup(markup)
+        table = soup.body and soup.body.table
+    if table is None:
+        return [], [], soup
+    heads, rows = _rows_from_table(table)
+    return heads, rows, soup
+
+
+def parse_cse_tree(markup, strained=True):
+    """Returns `(pres, soup)`, the first text of every <pre> on the CSE
+    page.  With `strained` only the <pre> blocks are built."""
+    if strained:
+        soup = BeautifulSoup(markup, parseOnlyThese=SoupStrainer('pre'))
+        pres = soup.findAll('pre')
+    else:
+        soup = BeautifulSoup(markup)
+        pres = soup.body and soup.body.findAll('pre') or []
+    return [pre.contents and pre.contents[0] or '' for pre in pres], soup
+
+
+# Fallback order of the modes each exchange page can be parsed with.
+DSE_PARSE_MODES = (PARSE_STREAM, PARSE_STRAINED, PARSE_FULL)
+CSE_PARSE_MODES = (PARSE_REGEX, PARSE_STRAINED, PARSE_FULL)
+
+
+def parse_dse(markup, mode=PARSE_STREAM, stats=None):
+    """Returns `(heads, rows)` of the DSE price table.
+
+    Starts with `mode` and falls back to the next, more forgiving, mode
+    whenever a mode comes back without any rows.  Pass a `ParseStats` as
+    `stats` to find out what the parse cost.
+    """
+    modes = DSE_PARSE_MODES[list(DSE_PARSE_MODES).index(mode):]
+    start = time.time()
+    for mode in modes:
+        soup = None
+        if mode == PARSE_STREAM:
+            heads, rows = parse_dse_stream(markup)
+        else:
+            heads, rows, soup = parse_dse_tree(markup, mode == PARSE_STRAINED)
+        if stats is not None:
+            stats.mode = mode
+            # The modes that came back empty cost time too.
+            stats.elapsed = time.time() - start
+            stats.measure(soup)
+        if soup is not None:
+            # The values picked are strings of the tree, free it instead
+            # of letting them keep all of it alive.
+            soup.decompose()
+        if rows:
+            break
+        if stats is not None and mode != modes[-1]:
+            stats.fallbacks.append(mode)
+    return heads, rows
+
+
+def parse_cse(markup, mode=PARSE_REGEX, stats=None):
+    """Returns the first text of every <pre> block of the CSE page, falling
+    back to a tree parse if the regex one does not find the report."""
+    modes = CSE_PARSE_MODES[list(CSE_PARSE_MODES).index(mode):]
+    start = time.time()
+    for mode in modes:
+        soup = None
+        if mode == PARSE_REGEX:
+            pres = _RE_PRE_TEXT.findall(markup)
+        else:
+            pres, soup = parse_cse_tree(markup, mode == PARSE_STRAINED)
+        if stats is not None:
+            stats.mode = mode
+            stats.elapsed = time.time() - start
+            stats.measure(soup)
+        if soup is not None:
+            soup.decompose()
+        if len(pres) >= 2:
+            break
+        if stats is not None and mode != modes[-1]:
+            stats.fallbacks.append(mode)
+    return pres
+
+
+def parse_cse_rows(text):
+    """Returns `(rows, rejected)` for the CSE report text.
+
+    `rows` are `[code, open, high, low, close, prev close, difference,
+    trades, volume]` lists picked with a single scan over the whole report,
+    `rejected` is the number of non blank lines that are not price rows.
+    """
+    rows = [list(m.groups()) for m in _RE_CSE_ROW.finditer(text)]
+    rejected = len(_RE_NON_BLANK_LINE.findall(text)) - len(rows)
+    return rows, rejected
+
+
+def parse_dse_time(markup):
+    """Returns the "Last update on" time of the DSE index page, or None if
+    `markup` does not have it."""
+    match = _RE_DSE_TIME.search(markup)
+    if match is None:
+        return None
+    return datetime.datetime.strptime(match.group().replace(' ', ''),
+                                      "%b%d,%Yat%H:%M:%S")
+
+
+def read_dse_time(f, chunk_size=4 * 1024):
+    """Reads the DSE index page from the file like `f` only as far as the
+    time of the last update.  Returns `(last_update, bytes_read)`, where
+    `last_update` is None if the page ended without one."""
+    tail, bytes_read = '', 0
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return None, bytes_read
+        bytes_read += len(chunk)
+        # Keep the end of the previous chunk, the time may straddle both.
+        tail = tail[-64:] + chunk
+        last_update = parse_dse_time(tail)
+        if last_update is not None:
+            return last_update, bytes_read
+
+
+def stamp_heads(heads):
+    """Puts the Date and Time columns after the company code."""
+    return heads[:1] + ['Date', 'Time'] + heads[1:]
+
+
+def to_csv(rows, heads=None):
+    output = StringIO.StringIO()
+    csvfile = csv.writer(output)
+    if heads:
+        csvfile.writerow(heads)
+    csvfile.writerows(rows)
+    csvdata = output.getvalue()
+    output.close()
+    return csvdata
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""Checks the bars BarBuilder works out of successive day figures.
+
+    python test_bars.py
+"""
+
+__author__ = "M Nasimul Haque (nasim.haque@gmail.com)"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2010 M Nasimul Haque"
+__license__ = "New-style BSD"
+
+import datetime
+import unittest
+
+import bars
+import quotes
+
+
+OPEN = datetime.datetime(2010, 10, 3, 11, 0)
+
+
+def _minutes(n):
+    return OPEN + datetime.timedelta(minutes=n)
+
+
+def _snapshot(when, *companies):
+    """`companies` are `(symbol, ltp, day high, day low, trades, volume)`."""
+    return quotes.DSE.snapshot(
+        [[symbol, str(ltp), str(high), str(low), str(ltp), '10', '0',
+          str(trades), '0', str(volume)]
+         for symbol, ltp, high, low, trades, volume in companies], when)
+
+
+def _bar(bar):
+    return (bar.symbol, bar.start, bar.open, bar.high, bar.low, bar.close,
+            bar.trades, bar.volume)
+
+
+class BarBuilderTest(unittest.TestCase):
+
+    def test_deltas(self):
+        builder = bars.BarBuilder(5)
+        # What traded before the builder started is left out.
+        self.assertEqual(builder.add(_snapshot(
+            _minutes(0), ('ACI', 10, 10, 10, 1, 100))), [])
+        builder.add(_snapshot(_minutes(1), ('ACI', 11, 11, 10, 2, 150)))
+        builder.add(_snapshot(_minutes(3), ('ACI', 9, 12, 9, 4, 300)))
+        # Nothing traded.
+        builder.add(_snapshot(_minutes(4), ('ACI', 9, 12, 9, 4, 300)))
+        finished = builder.add(_snapshot(_minutes(5),
+                                         ('ACI', 9.5, 12, 9, 5, 310)))
+        # The day high moved to 12 in the interval, so it traded there.
+        self.assertEqual([_bar(bar) for bar in finished],
+                         [('ACI', _minutes(0), 11.0, 12.0, 9.0, 9.0, 3, 200)])
+        self.assertEqual([_bar(bar) for bar in builder.flush()],
+                         [('ACI', _minutes(5), 9.5, 9.5, 9.5, 9.5, 1, 10)])
+        self.assertEqual(builder.flush(), [])
+
+    def test_volume_reset(self):
+        builder = bars.BarBuilder(1)
+        builder.add(_snapshot(_minutes(0), ('ACI', 10, 10, 10, 1, 100)))
+        builder.add(_snapshot(_minutes(1), ('ACI', 10, 10, 10, 2, 150)))
+        # The exchange corrects its figures down: no bar, and they count
+        # from there on.
+        finished = builder.add(_snapshot(_minutes(2),
+                                         ('ACI', 10, 10, 10, 1, 80)))
+        self.assertEqual([bar.volume for bar in finished], [50])
+        finished = builder.add(_snapshot(_minutes(3),
+                                         ('ACI', 10, 10, 10, 2, 90)))
+        self.assertEqual(finished, [])
+        self.assertEqual([(bar.trades, bar.volume)
+                          for bar in builder.flush()], [(1, 10)])
+
+    def test_next_day_counts_from_the_open(self):
+        builder = bars.BarBuilder(15)
+        builder.add(_snapshot(_minutes(0), ('ACI', 10, 10, 10, 1, 100)))
+        builder.add(_snapshot(_minutes(1), ('ACI', 12, 12, 10, 3, 400)))
+        tomorrow = _minutes(24 * 60 + 2)
+        finished = builder.add(_snapshot(tomorrow,
+                                         ('ACI', 20, 21, 19, 4, 30),
+                                         ('NEW', 5, 5, 5, 1, 7)))
+        self.assertEqual([_bar(bar) for bar in finished],
+                         [('ACI', _minutes(0), 12.0, 12.0, 12.0, 12.0, 2,
+                           300)])
+        self.assertEqual([_bar(bar) for bar in builder.flush()],
+                         [('ACI', _minutes(24 * 60), 20.0, 21.0, 19.0, 20.0,
+                           4, 30),
+                          ('NEW', _minutes(24 * 60), 5.0, 5.0, 5.0, 5.0, 1,
+                           7)])
+
+    def test_unknown_figures(self):
+        builder = bars.BarBuilder(1)
+        rows = [['ACI', '10', '10', '10', '10', '10', '0', 'n/a', '0', '100']]
+        builder.add(quotes.DSE.snapshot(rows, _minutes(0)))
+        rows = [['ACI', '11', '11', '10', '11', '10', '1', 'n/a', '0', '160'],
+                ['ZEAL', 'n/a', '', '', '', '', '', '', '', '50']]
+        builder.add(quotes.DSE.snapshot(rows, _minutes(0.5)))
+        self.assertEqual([_bar(bar) for bar in builder.flush()],
+                         [('ACI', _minutes(0), 11.0, 11.0, 11.0, 11.0, 0,
+                           60)])
+
+    def test_intervals(self):
+        when = datetime.datetime(2010, 10, 3, 13, 59, 12)
+        self.assertEqual(bars.BarBuilder(1).interval(when),
+                         datetime.datetime(2010, 10, 3, 13, 59))
+        self.assertEqual(bars.BarBuilder(15).interval(when),
+                         datetime.datetime(2010, 10, 3, 13, 45))
+        self.assertEqual(bars.BarBuilder(90).interval(when),
+                         datetime.datetime(2010, 10, 3, 13, 30))
+
+    def test_to_rows(self):
+        bar = bars.Bar('ACI', _minutes(5), 35.65, 36.0, 35.1, 35.6, 3, 200)
+        self.assertEqual(bars.to_rows([bar], quotes.DSE, '%Y-%m-%d'),
+                         [['ACI', '2010-10-03', '11:05:00', '35.65', '36.0',
+                           '35.1', '35.6', '3', '200']])
+        self.assertEqual(bars.to_rows([bar], quotes.CSE, '%Y-%m-%d')[0][3:7],
+                         ['35.65', '36.00', '35.10', '35.60'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+"""Checks the intraday history, appends cut short by a crash included.
+
+    python test_history.py
+"""
+
+__author__ = "M Nasimul Haque (nasim.haque@gmail.com)"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2010 M Nasimul Haque"
+__license__ = "New-style BSD"
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import history
+import quotes
+
+
+OPEN = datetime.datetime(2010, 10, 3, 11, 0)
+
+
+def _minutes(n):
+    return OPEN + datetime.timedelta(minutes=n)
+
+
+def _snapshot(when, volume=100):
+    rows = [['ACI', '35.65', '36.0', '35.1', '35.65', '35.2', '0.45', '12',
+             '1,240', str(volume)],
+            ['BEXIMCO', '120.5', '121', '119', '120.5', '119.5', '1', '30',
+             '3.6', str(volume * 3)],
+            ['ZEAL', 'n/a', '', '', '', '', '', '', '', '0']]
+    return quotes.DSE.snapshot(rows, when)
+
+
+def _values(snapshot):
+    return [(quote.symbol, quote.ltp, quote.high, quote.value, quote.volume)
+            for quote in snapshot]
+
+
+class HistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.history = history.History(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _filenames(self):
+        return self.history._filenames('dse', OPEN.date())
+
+    def test_round_trip(self):
+        snapshots = [_snapshot(_minutes(i), 100 + i) for i in xrange(3)]
+        for snapshot in snapshots:
+            self.assertEqual(self.history.append('dse', snapshot), 3)
+        session = self.history.session('dse', OPEN.date())
+        self.assertEqual([s.last_update for s in session],
+                         [s.last_update for s in snapshots])
+        for stored, snapshot in zip(session, snapshots):
+            self.assertEqual(_values(stored), _values(snapshot))
+        self.assertEqual(self.history.days('dse'), [OPEN.date()])
+        self.assertEqual(self.history.session('cse', OPEN.date()), [])
+
+    def test_no_going_back(self):
+        self.history.append('dse', _snapshot(_minutes(1)))
+        self.assertEqual(self.history.append('dse', _snapshot(_minutes(1))), 0)
+        self.assertEqual(self.history.append('dse', _snapshot(_minutes(0))), 0)
+        self.assertEqual(len(self.history.index('dse', OPEN.date())), 1)
+
+    def test_snapshot_as_of(self):
+        for i in (0, 5, 10):
+            self.history.append('dse', _snapshot(_minutes(i), 100 + i))
+        self.assertEqual(self.history.snapshot('dse', _minutes(7)).last_update,
+                         _minutes(5))
+        self.assertEqual(self.history.snapshot('dse', _minutes(10)).last_update,
+                         _minutes(10))
+        self.assertEqual(self.history.snapshot('dse', _minutes(-1)), None)
+
+    def test_symbol(self):
+        for i in xrange(3):
+            self.history.append('dse', _snapshot(_minutes(i), 100 + i))
+        found = self.history.symbol('dse', OPEN.date(), 'BEXIMCO')
+        self.assertEqual([quote.volume for quote in found], [300, 303, 306])
+        self.assertEqual(self.history.symbol('dse', OPEN.date(), 'NONE'), [])
+
+    def test_crash_between_data_and_index(self):
+        self.history.append('dse', _snapshot(_minutes(0)))
+        data_name = self._filenames()[0]
+        # Records of a snapshot whose index entry was never written, the
+        # last of them torn.
+        f = open(data_name, 'ab')
+        f.write('\x01' * (history.RECORD.size * 2 + 7))
+        f.close()
+        self.assertEqual(len(self.history.session('dse', OPEN.date())), 1)
+
+        self.history.append('dse', _snapshot(_minutes(1), 200))
+        self.assertEqual(os.path.getsize(data_name), history.RECORD.size * 6)
+        session = self.history.session('dse', OPEN.date())
+        self.assertEqual(len(session), 2)
+        self.assertEqual(_values(session[1]),
+                         _values(_snapshot(_minutes(1), 200)))
+
+    def test_torn_index_entry(self):
+        self.history.append('dse', _snapshot(_minutes(0)))
+        index_name = self._filenames()[1]
+        f = open(index_name, 'ab')
+        f.write('\x02' * (history.INDEX_RECORD.size - 5))
+        f.close()
+        self.assertEqual(len(self.history.index('dse', OPEN.date())), 1)
+
+        for i in (1, 2):
+            self.history.append('dse', _snapshot(_minutes(i), 100 + i))
+        self.assertEqual(os.path.getsize(index_name),
+                         history.INDEX_RECORD.size * 3)
+        self.assertEqual([entry[0] for entry in
+                          self.history.index('dse', OPEN.date())],
+                         [_minutes(0), _minutes(1), _minutes(2)])
+        self.assertEqual(_values(self.history.session('dse', OPEN.date())[2]),
+                         _values(_snapshot(_minutes(2), 102)))
+
+    def test_read_back_printing(self):
+        self.history.append('dse', _snapshot(_minutes(0)))
+        stored = self.history.session('dse', OPEN.date())[0]
+        rows = quotes.to_rows(stored, '%Y-%m-%d', False)[0]
+        # No page text to go by, but nothing is rounded away.
+        self.assertEqual(rows[0][3:], ['35.65', '36.0', '35.1', '35.65',
+                                       '35.2', '0.45', '12', '1240.0', '100'])
+        self.assertEqual(rows[2][3:], [''] * 6 + ['', '', '0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
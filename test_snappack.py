@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""Checks snappack against the ways memcache lets chunks go missing or get
+mixed up.
+
+    python test_snappack.py
+"""
+
+__author__ = "M Nasimul Haque (nasim.haque@gmail.com)"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2010 M Nasimul Haque"
+__license__ = "New-style BSD"
+
+import cStringIO as StringIO
+import gzip
+import random
+import unittest
+
+import snappack
+
+
+def _csv(n, seed=0):
+    rand = random.Random(seed)
+    return ''.join(['CO%04d,10-03-2010,15:00:00,%.1f,%d\r\n' % (
+        i, rand.uniform(10, 500), rand.randint(0, 100000)) for i in xrange(n)])
+
+
+class PackTest(unittest.TestCase):
+
+    def test_round_trip_in_chunks(self):
+        data = _csv(2000)
+        stats = snappack.PackStats()
+        manifest, chunks = snappack.pack(data, chunk_size=1000, stats=stats)
+        self.assert_(len(chunks) > 1)
+        self.assertEqual(manifest['chunks'], len(chunks))
+        self.assertEqual(stats.chunks, len(chunks))
+        self.assert_(0 < stats.ratio() < 1)
+        self.assertEqual(snappack.unpack(manifest, chunks), data)
+
+    def test_empty(self):
+        manifest, chunks = snappack.pack('')
+        self.assertEqual(manifest['chunks'], 1)
+        self.assertEqual(snappack.unpack(manifest, chunks), '')
+
+    def test_missing_chunk(self):
+        manifest, chunks = snappack.pack(_csv(2000), chunk_size=1000)
+        chunks[1] = None
+        self.assertEqual(snappack.unpack(manifest, chunks), None)
+        self.assertEqual(snappack.unpack(manifest, chunks[:-1]), None)
+
+    def test_chunks_of_another_version(self):
+        old_manifest, old_chunks = snappack.pack(_csv(2000), chunk_size=1000)
+        manifest, chunks = snappack.pack(_csv(2000, 1), chunk_size=1000)
+        self.assertNotEqual(old_manifest['version'], manifest['version'])
+        self.assertEqual(snappack.unpack(manifest, old_chunks), None)
+        # One stale chunk in among the new ones.
+        mixed = list(chunks)
+        mixed[1] = old_chunks[1]
+        self.assertEqual(snappack.unpack(manifest, mixed), None)
+
+    def test_version_mismatch_same_size(self):
+        data = _csv(200)
+        manifest, chunks = snappack.pack(data)
+        other = data[:-2] + 'X\n'
+        self.assertEqual(len(other), len(data))
+        self.assertEqual(snappack.unpack(manifest, snappack.pack(other)[1]),
+                         None)
+
+    def test_corrupt_chunk(self):
+        manifest, chunks = snappack.pack(_csv(200))
+        middle = len(chunks[0]) // 2
+        corrupt = (chunks[0][:middle] + chr(ord(chunks[0][middle]) ^ 0xff) +
+                   chunks[0][middle + 1:])
+        self.assertEqual(snappack.unpack(manifest, [corrupt]), None)
+
+    def test_to_gzip(self):
+        data = _csv(500)
+        manifest, chunks = snappack.pack(data, chunk_size=1000)
+        body = snappack.to_gzip(''.join(chunks), data)
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO.StringIO(body)).read(),
+                         data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""When the DSE and CSE trade, and how often they publish new prices."""
+
+__author__ = "M Nasimul Haque (nasim.haque@gmail.com)"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2010 M Nasimul Haque"
+__license__ = "New-style BSD"
+
+import datetime
+import os
+
+
+HOLIDAYS_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             'holidays.txt')
+
+# Bangladesh is UTC+6 all year round.
+DHAKA_OFFSET = datetime.timedelta(hours=6)
+
+SUNDAY, MONDAY, TUESDAY, WEDNESDAY, THURSDAY = 6, 0, 1, 2, 3
+
+
+def dhaka_now():
+    """Returns the time in Dhaka, whatever the clock of this machine says."""
+    return datetime.datetime.utcnow() + DHAKA_OFFSET
+
+
+def seconds(delta):
+    return delta.days * 24 * 60 * 60 + delta.seconds + \
+        delta.microseconds / 1e6
+
+
+def load_holidays(filename=HOLIDAYS_FILE):
+    """Reads the holidays in `filename`, one per line as YYYY-MM-DD or, for
+    the ones on the same day every year, as MM-DD.  Text after a # is a
+    comment."""
+    holidays = set()
+    try:
+        f = open(filename)
+    except IOError:
+        return holidays
+    try:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            parts = [int(part) for part in line.split('-')]
+            if len(parts) == 2:
+                holidays.add(tuple(parts))
+            else:
+                holidays.add(datetime.date(*parts))
+    finally:
+        f.close()
+    return holidays
+
+
+class TradingCalendar(object):
+    """Trading days and hours of the exchanges, in Dhaka time.
+
+    `before` and `after` widen the session, so the pre-opening prices and
+    the closing ones published a little after the bell are not missed.
+    """
+
+    def __init__(self, holidays=None, weekdays=(SUNDAY, MONDAY, TUESDAY,
+                                                WEDNESDAY, THURSDAY),
+                 opens=datetime.time(11, 0), closes=datetime.time(15, 0),
+                 before=datetime.timedelta(minutes=15),
+                 after=datetime.timedelta(minutes=30)):
+        if holidays is None:
+            holidays = load_holidays()
+        self.holidays = holidays
+        self.weekdays = weekdays
+        self.opens = opens
+        self.closes = closes
+        self.before = before
+        self.after = after
+
+    def is_trading_day(self, day):
+        return (day.weekday() in self.weekdays and
+                day not in self.holidays and
+                (day.month, day.day) not in self.holidays)
+
+    def session(self, day):
+        """Returns `(start, end)` of the polling window on `day`."""
+        return (datetime.datetime.combine(day, self.opens) - self.before,
+                datetime.datetime.combine(day, self.closes) + self.after)
+
+    def is_open(self, when):
+        if not self.is_trading_day(when.date()):
+            return False
+        start, end = self.session(when.date())
+        return start <= when < end
+
+    def next_open(self, when):
+        """Returns when the next polling window starts, `when` itself if it
+        is in one."""
+        day = when.date()
+        for i in xrange(366):
+            if self.is_trading_day(day):
+                start, end = self.session(day)
+                if when < end:
+                    return max(start, when)
+            day += datetime.timedelta(days=1)
+        raise ValueError('no trading day within a year of %s' % when)
+
+
+class UpdateCadence(object):
+    """Learns how often an exchange publishes prices from the last update
+    times it reports, and tells when the next update is due.
+
+    `updates` holds the last update times seen, oldest first.  It is all the
+    state there is, so it can be kept anywhere between runs.
+    """
+
+    def __init__(self, updates=None, default=60, minimum=30, maximum=15 * 60,
+                 lag=15, samples=8):
+        self.updates = updates or []
+        self.default = default
+        self.minimum = minimum
+        self.maximum = maximum
+        self.lag = lag
+        self.samples = samples
+
+    def observe(self, last_update):
+        if last_update is None:
+            return
+        if self.updates and last_update <= self.updates[-1]:
+            return
+        self.updates.append(last_update)
+        del self.updates[:-(self.samples + 1)]
+
+    def interval(self):
+        """Returns the median seconds between two updates of one session,
+        or None before two updates have been seen."""
+        gaps = []
+        for previous, update in zip(self.updates, self.updates[1:]):
+            if previous.date() == update.date():
+                gaps.append(seconds(update - previous))
+        if not gaps:
+            return None
+        gaps.sort()
+        return gaps[len(gaps) // 2]
+
+    def wait(self, now):
+        """Returns the seconds to wait from `now` before polling again."""
+        interval = self.interval()
+        if interval is None:
+            wait = self.default
+        else:
+            due = self.updates[-1] + datetime.timedelta(seconds=interval)
+            wait = seconds(due - now) + self.lag
+            if wait <= 0:
+                # Overdue, keep looking at the pace it usually updates at.
+                wait = interval
+        return int(max(self.minimum, min(self.maximum, wait)))
+
+
+def seconds_to_next_poll(calendar, cadences, now=None):
+    """Returns the seconds to wait before polling exchanges with the given
+    `cadences` again."""
+    if now is None:
+        now = dhaka_now()
+    if not calendar.is_open(now):
+        return max(1, int(seconds(calendar.next_open(now) - now)))
+    return min([cadence.wait(now) for cadence in cadences])